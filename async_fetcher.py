@@ -0,0 +1,210 @@
+import asyncio
+import json
+import time
+from itertools import islice
+import requests
+from nse_data_fetcher import NSEDataFetcher
+from retry_policy import SESSION_FAILURES
+import telemetry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+class AsyncNSEDataFetcher(NSEDataFetcher):
+    """NSEDataFetcher that runs each endpoint's plan on an asyncio event loop with httpx.
+
+    Config, schema, planning, caching, checkpoints and writes are shared with
+    NSEDataFetcher; only the HTTP side differs. One pooled keep-alive client
+    (HTTP/2 when h2 is installed) carries up to `max_concurrency` requests in
+    flight, with brotli/gzip decoded by the client. Cookies come from the usual
+    warm-up session and are refreshed when NSE rejects them. Plan expansion,
+    checkpoints, the job queue, the response cache and writes all block, so
+    they run in worker threads and the event loop only does HTTP.
+
+    `max_concurrency` only bounds requests in flight; the request rate is
+    always bounded by a token bucket, `DEFAULT_REQUESTS_PER_SECOND` unless
+    `requests_per_second` is given.
+    """
+
+    DEFAULT_REQUESTS_PER_SECOND = 5
+
+    def __init__(self, config_path, max_concurrency=200, http2=True, **kwargs):
+        if httpx is None:
+            raise ImportError("AsyncNSEDataFetcher requires httpx (and h2 for HTTP/2)")
+        if kwargs.get("pipeline") or kwargs.get("stream_batch_size"):
+            raise ValueError("AsyncNSEDataFetcher does not support pipeline or stream_batch_size")
+        # Without a budget every in-flight slot would fire at once; the threaded
+        # fetcher's random sleep is no limit at this concurrency
+        kwargs["requests_per_second"] = kwargs.get("requests_per_second") or self.DEFAULT_REQUESTS_PER_SECOND
+        super().__init__(config_path, **kwargs)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.http2 = http2 and h2 is not None
+        self.cookie_generation = 0
+
+    def _build_client(self):
+        cookies = httpx.Cookies()
+        for cookie in self.session.cookies:
+            cookies.set(cookie.name, cookie.value, domain=cookie.domain, path=cookie.path)
+        # Connection headers are hop-by-hop and not allowed over HTTP/2
+        headers = {key: value for key, value in self.headers.items() if key.lower() != "connection"}
+        headers["Accept-Encoding"] = "gzip, deflate, br"
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        proxy = self.proxies["https"] if self.proxies else None
+        return httpx.AsyncClient(http2=self.http2, headers=headers, cookies=cookies, limits=limits,
+                                 timeout=60, proxy=proxy)
+
+    async def _throttle_async(self):
+        while True:
+            wait_time = self.rate_limiter.try_acquire()
+            if not wait_time:
+                return
+            await asyncio.sleep(wait_time)
+
+    async def _rotate_cookies(self, client, generation):
+        """Fetch new cookies for the client, unless another request already did"""
+        async with self.cookie_lock:
+            if generation != self.cookie_generation:
+                return
+            print("Session rejected, refreshing cookies...")
+            self.session = await asyncio.to_thread(self.get_fresh_cookies)
+            self.cookies = {cookie.name: cookie.value for cookie in self.session.cookies}
+            client.cookies.clear()
+            for cookie in self.session.cookies:
+                client.cookies.set(cookie.name, cookie.value, domain=cookie.domain, path=cookie.path)
+            self.cookie_generation += 1
+            self.visited_referers.clear()
+
+    async def _send_async(self, client, endpoint, url, referer_url, retry_timeouts=True):
+        generation = None
+
+        async def send():
+            nonlocal generation
+            generation = self.cookie_generation
+            try:
+                # Every attempt and referer visit takes its own token from the rate budget
+                if self.referer_mode == "per_request" or referer_url not in self.visited_referers:
+                    await self._throttle_async()
+                    referer_response = await client.get(referer_url)
+                    if referer_response.is_success:
+                        self.visited_referers.add(referer_url)
+                await self._throttle_async()
+                return await client.get(url)
+            except httpx.TimeoutException as e:
+                raise requests.exceptions.Timeout(str(e))
+            except httpx.TransportError as e:
+                raise requests.exceptions.ConnectionError(str(e))
+
+        async def on_failure(kind, response):
+            self.metrics.inc("nse_retries_total", endpoint=self.current_endpoint, kind=kind)
+            if kind in SESSION_FAILURES:
+                await self._rotate_cookies(client, generation)
+
+        with self.metrics.span("nse_request", endpoint=self.current_endpoint):
+            response = await self.retry_policy.call_async(endpoint, send, on_failure, retry_timeouts=retry_timeouts)
+        if response.is_error:
+            raise requests.exceptions.HTTPError(f"HTTP {response.status_code} for {url}")
+        return response
+
+    async def _fetch_async(self, client, planner, endpoint, request_params, referer_url):
+        """Fetch and parse one request, splitting date windows that time out"""
+        cached = await asyncio.to_thread(self._cached_response, endpoint, request_params)
+        if cached is not None:
+            return cached
+        url = self._api_url(endpoint, request_params)
+        if self.cache_only:
+            self._log_error(f"Cache miss in cache_only mode for endpoint {endpoint} with params {request_params}")
+            return None
+
+        start_time = time.monotonic()
+        try:
+            response = await self._send_async(client, endpoint, url, referer_url, retry_timeouts=planner is None)
+        except requests.exceptions.Timeout as e:
+            halves = planner.split(request_params) if planner is not None else None
+            if halves is None:
+                self._log_error(f"Request error for URL {url}: {str(e)}")
+                return None
+            planner.observe_timeout()
+            print(f"Request timed out, splitting window {request_params['from_date']} - {request_params['to_date']}")
+            combined = []
+            for half in halves:
+                half_result = await self._fetch_async(client, planner, endpoint, {**request_params, **half}, referer_url)
+                if half_result is None:
+                    return None
+                combined.extend(self._extract_rows(half_result) or [])
+            return combined
+        except requests.exceptions.RequestException as e:
+            self._log_error(f"Request error for URL {url}: {str(e)}")
+            return None
+
+        body = response.content
+        self.metrics.inc("nse_bytes_downloaded_total", response.num_bytes_downloaded, endpoint=self.current_endpoint)
+        self.metrics.inc("nse_bytes_decompressed_total", len(body), endpoint=self.current_endpoint)
+        self.metrics.observe("nse_response_bytes", len(body), buckets=telemetry.BYTES_BUCKETS, endpoint=self.current_endpoint)
+        if not body:
+            self._log_error(f"Empty response received for URL: {url}")
+            return None
+        try:
+            with self.metrics.span("nse_decode", endpoint=self.current_endpoint):
+                result = json.loads(body)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            self._log_error(f"Error decoding JSON: {str(e)} for URL: {url}")
+            return None
+        if planner is not None:
+            rows = self._extract_rows(result)
+            planner.observe(len(rows) if isinstance(rows, list) else 0, len(body), time.monotonic() - start_time)
+        # Error payloads and a missing/non-list "data" are failures, never cached
+        if self.response_cache is not None and isinstance(self._extract_rows(result), list):
+            await asyncio.to_thread(self.response_cache.put, endpoint, request_params, body)
+        return result
+
+    async def _execute_plan_async(self, plan, endpoint_name, endpoint, referer_url, schema_map):
+        self.cookie_lock = asyncio.Lock()
+        self.visited_referers = set()
+        planner = self.window_planners.get(endpoint_name)
+        # HTTP/2 multiplexes many requests per connection, so the connection
+        # limit alone does not bound the requests in flight
+        in_flight = asyncio.Semaphore(self.max_concurrency)
+        total_rows_inserted = 0
+
+        async def fetch_and_write(request_params):
+            window_planner = planner if "from_date" in request_params else None
+            try:
+                async with in_flight:
+                    result = await self._fetch_async(client, window_planner, endpoint, request_params, referer_url)
+                return await asyncio.to_thread(self._handle_result, result, request_params, endpoint_name, schema_map)
+            except Exception as e:
+                self._log_error(f"Worker error for {endpoint_name} with params {request_params}: {str(e)}")
+                self._record_failure(endpoint_name, request_params)
+                return 0
+
+        async with self._build_client() as client:
+            pending = set()
+            plan_iter = iter(plan)
+            plan_done = False
+            while True:
+                # Keep the plan lazy: only twice the concurrency limit is scheduled at a time.
+                # Expanding it queries ingest_state and claims jobs, so it runs in a thread.
+                room = self.max_concurrency * 2 - len(pending)
+                if not plan_done and room > 0:
+                    batch = await asyncio.to_thread(list, islice(plan_iter, room))
+                    plan_done = len(batch) < room
+                    pending.update(asyncio.ensure_future(fetch_and_write(request_params)) for request_params in batch)
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        total_rows_inserted += task.result()
+                    except Exception as e:
+                        self._log_error(f"Worker error for {endpoint_name}: {str(e)}")
+        return total_rows_inserted
+
+    def _execute_plan(self, plan, endpoint_name, endpoint, referer_url, schema_map):
+        return asyncio.run(self._execute_plan_async(plan, endpoint_name, endpoint, referer_url, schema_map))
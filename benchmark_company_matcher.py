@@ -0,0 +1,130 @@
+import argparse
+import csv
+import time
+from difflib import SequenceMatcher
+from company_matcher import CompanyNameIndex
+from conference_call import ConferenceCall
+from postgres_utils import PGConn
+
+def linear_match(company_name, name_to_symbol, threshold=0.6):
+    """The original matcher: case-insensitive scan, then SequenceMatcher against every name"""
+    normalised_input = company_name.lower()
+    for name, symbol in name_to_symbol.items():
+        if normalised_input == name.lower():
+            return name, symbol
+    scores = [(name, SequenceMatcher(None, normalised_input, name).ratio()) for name in name_to_symbol]
+    best_match, best_score = max(scores, key=lambda pair: pair[1], default=('', 0))
+    if best_match and best_score >= threshold:
+        return best_match, name_to_symbol[best_match]
+    return None, None
+
+def load_titles(path):
+    with open(path, "r") as f:
+        return [line.strip().rstrip(",").strip() for line in f if line.strip()]
+
+def load_names(path):
+    """company_name,symbol rows from a CSV export of nse.metadata"""
+    with open(path, "r", newline="") as f:
+        return {row[0]: row[1] for row in csv.reader(f) if len(row) >= 2 and row[0] != "company_name"}
+
+def load_labels(path):
+    """name,symbol rows: the symbol a name should resolve to, "|"-separated if several are right, empty if none"""
+    with open(path, "r", newline="") as f:
+        return {row[0]: set(filter(None, row[1].split("|"))) for row in csv.reader(f)
+                if len(row) >= 2 and row[0] != "name"}
+
+def precision_recall(labels, predicted):
+    """(correct, wrong, precision, recall) of name -> symbol predictions against the labels"""
+    correct = wrong = 0
+    for name, expected in labels.items():
+        symbol = predicted.get(name)
+        if symbol:
+            if symbol in expected:
+                correct += 1
+            else:
+                wrong += 1
+    listed = sum(1 for expected in labels.values() if expected)
+    return correct, wrong, correct / max(1, correct + wrong), correct / max(1, listed)
+
+def report_labelled(labels, name_to_symbol, name_index, thresholds):
+    """Precision/recall of the linear matcher and of the index at each threshold"""
+    listed = sum(1 for expected in labels.values() if expected)
+    print(f"{len(labels)} labelled names, {listed} of them listed")
+    print(f"{'matcher':<18}{'correct':>9}{'wrong':>7}{'precision':>11}{'recall':>8}")
+    linear = {name: linear_match(name, name_to_symbol)[1] for name in labels}
+    correct, wrong, precision, recall = precision_recall(labels, linear)
+    print(f"{'linear @0.6':<18}{correct:>9}{wrong:>7}{precision:>11.3f}{recall:>8.3f}")
+    # Score every name once without a threshold, then apply each threshold
+    threshold = name_index.threshold
+    name_index.threshold = 0.0
+    scored = {name: name_index.match(name) for name in labels}
+    name_index.threshold = threshold
+    for threshold in thresholds:
+        predicted = {name: symbol for name, (_, symbol, score) in scored.items() if score >= threshold}
+        correct, wrong, precision, recall = precision_recall(labels, predicted)
+        label = f"indexed @{threshold:g}"
+        print(f"{label:<18}{correct:>9}{wrong:>7}{precision:>11.3f}{recall:>8.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the indexed company-name matcher with the linear SequenceMatcher scan.")
+    parser.add_argument("--titles", type=str, default="conference_calls.txt", help="Video titles, one per line (default: conference_calls.txt)")
+    parser.add_argument("--names", type=str, default=None, help="CSV of company_name,symbol; read from nse.metadata when omitted")
+    parser.add_argument("--scorer", choices=["ratio", "token_set"], default="ratio")
+    parser.add_argument("--threshold", type=float, default=CompanyNameIndex.DEFAULT_THRESHOLD,
+                        help=f"Indexed matcher threshold on normalized names (default: {CompanyNameIndex.DEFAULT_THRESHOLD})")
+    parser.add_argument("--labels", type=str, default=None, help="CSV of name,expected symbol to report precision/recall against")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=None, help="Thresholds to report precision/recall at (with --labels)")
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--show", type=int, default=20, help="Print this many disagreements (default: 20)")
+    args = parser.parse_args()
+
+    if args.names:
+        name_to_symbol = load_names(args.names)
+        psql_conn = None
+    else:
+        psql_conn = PGConn({
+                    "database": "datadump",
+                    "host": "localhost",
+                    "port": "5432",
+                    "user": "sparsh",
+                    "password": "algobulls"
+                })
+        name_to_symbol = None
+
+    cc = ConferenceCall(psql_conn, company_name_to_symbol_map=name_to_symbol)
+    name_to_symbol = cc.company_name_to_symbol_map
+    start_time = time.perf_counter()
+    cc.name_index = CompanyNameIndex(name_to_symbol, threshold=args.threshold, top_k=args.top_k, scorer=args.scorer)
+    build_seconds = time.perf_counter() - start_time
+
+    titles = load_titles(args.titles)
+    extracted = [name for name in (cc._extract_company_name(title) for title in titles) if name]
+    print(f"{len(titles)} titles, {len(extracted)} with an extracted name, {len(name_to_symbol)} companies")
+    print(f"Index built in {build_seconds * 1000:.1f} ms")
+
+    start_time = time.perf_counter()
+    linear_results = [linear_match(name, name_to_symbol) for name in extracted]
+    linear_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    indexed_results = [cc._get_company_from_name(name) for name in extracted]
+    indexed_seconds = time.perf_counter() - start_time
+
+    agree = sum(1 for old, new in zip(linear_results, indexed_results) if old == new)
+    linear_matched = sum(1 for result in linear_results if result[0])
+    indexed_matched = sum(1 for result in indexed_results if result[0])
+    per_title = 1e6 / max(1, len(extracted))
+    print(f"{'matcher':<10}{'seconds':>10}{'us/title':>12}{'matched':>10}")
+    print(f"{'linear':<10}{linear_seconds:>10.2f}{linear_seconds * per_title:>12.0f}{linear_matched:>10}")
+    print(f"{'indexed':<10}{indexed_seconds:>10.2f}{indexed_seconds * per_title:>12.0f}{indexed_matched:>10}")
+    print(f"Speedup: {linear_seconds / max(indexed_seconds, 1e-9):.1f}x, agreement: {agree}/{len(extracted)} ({100 * agree / max(1, len(extracted)):.1f}%)")
+
+    disagreements = [(name, old[0], new[0]) for name, old, new in zip(extracted, linear_results, indexed_results) if old != new]
+    for name, old, new in disagreements[:args.show]:
+        print(f"  {name!r}: linear={old!r} indexed={new!r}")
+
+    if args.labels:
+        report_labelled(load_labels(args.labels), name_to_symbol, cc.name_index, args.thresholds or [args.threshold])
+
+if __name__ == "__main__":
+    main()
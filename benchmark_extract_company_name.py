@@ -0,0 +1,64 @@
+import argparse
+import re
+import time
+from conference_call import ConferenceCall
+
+def legacy_extract_company_name(title):
+    """The original extraction: raw patterns through re.sub/re.search on every call"""
+    prefix_pattern = r'^(Earnings Call|Live:|Management Call|#|Q\dFY\d\d|Press Conference|Deleted on|Webinar:)\s+'
+    clean_title = re.sub(prefix_pattern, '', title, flags=re.IGNORECASE)
+    company_pattern = r'^(.*?)(?:\s+Earnings\s+Call|\s+Q&A|\s+:|\s+Investor\s+Call|\s+Conference\s+Call|\s+Webinar|\s+Business\s+Update|\s+Management\s+Call|\s+Press\s+Conference|\s+Analyst\s+Meeting|\s+IPO:|\s+\||\s+Capital\s+Markets\s+Day)'
+    match = re.search(company_pattern, clean_title, re.IGNORECASE)
+    if match:
+        company_name = match.group(1).strip()
+        company_name = re.sub(r'\s+(Ltd\.|Limited)(\s+for\s+Q)', r' \2', company_name)
+        if "Call with" in company_name:
+            company_name = company_name.split("Call with")[0].strip()
+        elif "Call between" in company_name:
+            company_name = company_name.split("Call between")[0].strip()
+        company_name = re.sub(r'\s+\([A-Z]+\)$', '', company_name)
+        company_name = re.sub(r'\s+Part\s+\d+:', '', company_name)
+        return company_name
+    return None
+
+def load_titles(path):
+    with open(path, "r") as f:
+        return [line.strip().rstrip(",").strip() for line in f if line.strip()]
+
+def best_of(repeat, func, titles):
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func(titles)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-title cost of the legacy and compiled company-name extraction.")
+    parser.add_argument("--titles", type=str, default="conference_calls.txt", help="Video titles, one per line (default: conference_calls.txt)")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per variant, best one reported (default: 20)")
+    args = parser.parse_args()
+
+    titles = load_titles(args.titles)
+    cc = ConferenceCall(None, company_name_to_symbol_map={})
+    variants = [
+        ("legacy", lambda batch: [legacy_extract_company_name(title) for title in batch]),
+        ("compiled", lambda batch: [cc._extract_company_name(title) for title in batch]),
+        ("batch", cc._extract_company_names)
+    ]
+
+    print(f"{len(titles)} titles, best of {args.repeat} runs")
+    print(f"{'variant':<10}{'ms total':>10}{'us/title':>10}")
+    results = {}
+    for name, func in variants:
+        elapsed, results[name] = best_of(args.repeat, func, titles)
+        print(f"{name:<10}{elapsed * 1000:>10.1f}{elapsed * 1e6 / max(1, len(titles)):>10.2f}")
+
+    mismatches = [(title, old, new) for title, old, new in zip(titles, results["legacy"], results["batch"]) if old != new]
+    print(f"Outputs differing from legacy: {len(mismatches)}")
+    for title, old, new in mismatches[:20]:
+        print(f"  {title!r}: legacy={old!r} compiled={new!r}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from nse_data_fetcher import NSEDataFetcher
+from async_fetcher import AsyncNSEDataFetcher
+from nse_standin_server import NSEStandInServer
+from postgres_utils import CopyRowStream
+from upsert_writer import NaturalKeyWriter
+from sinks import PostgresSink
+
+class DiscardingPGConn:
+    """Stand-in for PGConn that encodes rows for COPY but discards them.
+
+    Natural-key merges report every staged row as inserted, so the in-process
+    dedup is still exercised.
+    """
+
+    def __init__(self):
+        self.last_copied = 0
+
+    @contextmanager
+    def lease(self):
+        yield self
+
+    @contextmanager
+    def transaction(self):
+        yield self
+
+    def copy_rows(self, table_name, columns, rows):
+        stream = CopyRowStream(rows)
+        while stream.read(65536):
+            pass
+        self.last_copied = stream.row_count
+        return stream.row_count
+
+    def execute(self, sql, with_desc=False):
+        if "from inserted" in sql:
+            return [(self.last_copied,)]
+        if "pg_indexes" in sql:
+            return [(1,)]
+        return []
+
+class BenchmarkFetcher(NSEDataFetcher):
+    """NSEDataFetcher that writes through DiscardingPGConn instead of Postgres"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.psql_conn = DiscardingPGConn()
+        self.natural_key_writer = NaturalKeyWriter(self.psql_conn)
+        self.sinks[0] = PostgresSink(self.psql_conn, self.natural_key_writer, self.schema_options)
+
+class AsyncBenchmarkFetcher(AsyncNSEDataFetcher):
+    """AsyncNSEDataFetcher that writes through DiscardingPGConn instead of Postgres"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.psql_conn = DiscardingPGConn()
+        self.natural_key_writer = NaturalKeyWriter(self.psql_conn)
+        self.sinks[0] = PostgresSink(self.psql_conn, self.natural_key_writer, self.schema_options)
+
+def run_benchmark(server_url, config_path, endpoint_name, endpoint_config, workers, live_db, referer_mode,
+                  session_pool_size, stream_batch_size, pipeline, async_fetch=False, requests_per_second=10000):
+    if async_fetch:
+        # The worker count is the async fetcher's in-flight request limit
+        fetcher_class = AsyncNSEDataFetcher if live_db else AsyncBenchmarkFetcher
+        fetcher = fetcher_class(config_path, base_url=server_url, max_concurrency=workers,
+                                requests_per_second=requests_per_second, referer_mode=referer_mode)
+    else:
+        fetcher_class = NSEDataFetcher if live_db else BenchmarkFetcher
+        fetcher = fetcher_class(config_path, base_url=server_url, max_workers=workers,
+                                requests_per_second=requests_per_second, referer_mode=referer_mode,
+                                session_pool_size=session_pool_size, stream_batch_size=stream_batch_size,
+                                pipeline=pipeline)
+    start = time.perf_counter()
+    rows = fetcher.fetch_data(endpoint_name, endpoint_config)
+    return rows, time.perf_counter() - start
+
+def check_malformed_payloads(config_path, endpoint_name, endpoint_config, timeout=120):
+    """Regression check: malformed payloads must be logged and skipped, never stall the pipeline.
+
+    Half the responses are `{"data": ["not-a-dict"]}`. The pipeline fetch runs in
+    a daemon thread and the check fails if it has not finished within `timeout`.
+    """
+    server = NSEStandInServer(config_path=config_path, latency_ms=1, jitter_ms=0, malformed_rate=0.5, rows_per_request=20)
+    server.start()
+    outcome = {}
+    try:
+        fetcher = BenchmarkFetcher(config_path, base_url=server.url, max_workers=4, requests_per_second=10000,
+                                   referer_mode="per_session", pipeline=True, pipeline_queue_size=2, write_batch_rows=50)
+        runner = threading.Thread(target=lambda: outcome.update(rows=fetcher.fetch_data(endpoint_name, endpoint_config)),
+                                  daemon=True)
+        runner.start()
+        runner.join(timeout)
+    finally:
+        server.stop()
+    if runner.is_alive():
+        print(f"FAILED: pipeline still running after {timeout}s with malformed payloads")
+        return False
+    print(f"OK: pipeline finished with malformed payloads ({outcome.get('rows')} rows from the valid responses)")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end fetch -> decode -> write benchmark against the local NSE stand-in.")
+    parser.add_argument("--config", type=str, default="config", help="Config directory (default: config)")
+    parser.add_argument("--endpoint", type=str, default="AnnualReports", help="Endpoint from api.json to fetch (default: AnnualReports)")
+    parser.add_argument("--symbols", type=int, default=200, help="Limit list params to this many values (default: 200)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16], help="Concurrency settings to compare (default: 1 4 16)")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--encoding", choices=["identity", "gzip", "br"], default="gzip")
+    parser.add_argument("--rows", type=int, default=50, help="Synthetic rows per response (default: 50)")
+    parser.add_argument("--referer-mode", choices=["per_request", "per_session"], default="per_session")
+    parser.add_argument("--session-pool", type=int, default=None, help="Use a warm session pool of this size instead of refreshing every 20 requests")
+    parser.add_argument("--stream-batch-size", type=int, default=None, help="Decode responses incrementally and write in batches of this size")
+    parser.add_argument("--pipeline", action="store_true", help="Use the staged fetch -> normalize -> batched write pipeline")
+    parser.add_argument("--async-fetch", action="store_true", help="Use the asyncio/httpx fetcher, with --workers as the in-flight request limit")
+    parser.add_argument("--requests-per-second", type=float, default=10000, help="Request budget per run (default: 10000, effectively unthrottled)")
+    parser.add_argument("--live-db", action="store_true", help="Write to the local datadump database instead of discarding rows")
+    parser.add_argument("--check-malformed", action="store_true", help="Only check that malformed payloads cannot stall the pipeline")
+    args = parser.parse_args()
+
+    with open(os.path.join(args.config, "api.json"), "r") as f:
+        endpoint_config = json.load(f)[args.endpoint]
+    params = dict(endpoint_config.get("params", {}))
+    for key, value in params.items():
+        if isinstance(value, list):
+            params[key] = value[:args.symbols]
+    endpoint_config = {**endpoint_config, "params": params}
+    if args.check_malformed:
+        sys.exit(0 if check_malformed_payloads(args.config, args.endpoint, endpoint_config) else 1)
+
+    server = NSEStandInServer(config_path=args.config, latency_ms=args.latency_ms, error_rate=args.error_rate,
+                              encoding=args.encoding, rows_per_request=args.rows)
+    server.start()
+    try:
+        for workers in args.workers:
+            requests_before = server.request_count
+            rows, elapsed = run_benchmark(server.url, args.config, args.endpoint, endpoint_config,
+                                          workers, args.live_db, args.referer_mode, args.session_pool,
+                                          args.stream_batch_size, args.pipeline, args.async_fetch,
+                                          args.requests_per_second)
+            http_requests = server.request_count - requests_before
+            print(f"workers={workers:>3}: {rows} rows in {elapsed:.2f}s "
+                  f"({rows / elapsed:,.0f} rows/s, {http_requests / elapsed:,.1f} HTTP req/s)")
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import datetime
+import random
+import string
+import time
+from postgres_utils import PGConn, CopyRowStream
+from nse_data_fetcher import NSEDataFetcher
+from row_mapper import RowMapper
+
+# Mirrors the nse.announcements table from metadata_setup/create_db.sql
+ANNOUNCEMENTS_SCHEMA = {
+    "symbol": "symbol",
+    "description": "desc",
+    "attachment_file": "attchmntFile",
+    "company_name": "sm_name",
+    "isin": "sm_isin",
+    "date": "an_dt",
+    "industry": "smIndustry",
+    "attachment_text": "attchmntText"
+}
+
+def _random_text(length):
+    return "".join(random.choices(string.ascii_letters + " '\t", k=length))
+
+def make_synthetic_rows(count, seed=42):
+    """Generate Announcements-shaped API rows, including quotes, tabs and empty values"""
+    random.seed(seed)
+    base_date = datetime.datetime(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        rows.append({
+            "symbol": f"SYM{i % 2000}",
+            "desc": _random_text(40),
+            "attchmntFile": f"https://nsearchives.nseindia.com/corporate/{i}.pdf",
+            "sm_name": f"Company's Name {i % 2000} Limited",
+            "sm_isin": f"INE{i:09d}",
+            "an_dt": (base_date + datetime.timedelta(minutes=i)).strftime("%d-%b-%Y %H:%M:%S"),
+            "smIndustry": random.choice(["Banks", "Pharmaceuticals", "", None]),
+            "attchmntText": _random_text(200)
+        })
+    return rows
+
+def bench_insert_build(rows):
+    start = time.perf_counter()
+    sql = NSEDataFetcher._build_insert_sql(rows, "write_benchmark", ANNOUNCEMENTS_SCHEMA)
+    return time.perf_counter() - start, len(sql.encode("utf-8"))
+
+def bench_copy_encode(rows):
+    api_keys = list(ANNOUNCEMENTS_SCHEMA.values())
+    start = time.perf_counter()
+    stream = CopyRowStream([item.get(api_key) for api_key in api_keys] for item in rows)
+    total_bytes = 0
+    while True:
+        chunk = stream.read(8192)
+        if not chunk:
+            break
+        total_bytes += len(chunk)
+    return time.perf_counter() - start, total_bytes
+
+def bench_row_mapping(rows, column_types=None):
+    """Time the per-cell dict.get loop against the compiled RowMapper"""
+    api_keys = list(ANNOUNCEMENTS_SCHEMA.values())
+    start = time.perf_counter()
+    [[item.get(api_key) for api_key in api_keys] for item in rows]
+    loop_time = time.perf_counter() - start
+    mapper = RowMapper(ANNOUNCEMENTS_SCHEMA, column_types)
+    start = time.perf_counter()
+    mapper.map_rows(rows)
+    return loop_time, time.perf_counter() - start
+
+def bench_live(psql_conn, rows):
+    columns = list(ANNOUNCEMENTS_SCHEMA.keys())
+    api_keys = list(ANNOUNCEMENTS_SCHEMA.values())
+    psql_conn.execute("create unlogged table if not exists nse.write_benchmark (like nse.announcements);")
+    try:
+        psql_conn.execute("truncate nse.write_benchmark;")
+        start = time.perf_counter()
+        sql = NSEDataFetcher._build_insert_sql(rows, "write_benchmark", ANNOUNCEMENTS_SCHEMA)
+        psql_conn.execute(sql)
+        insert_time = time.perf_counter() - start
+
+        psql_conn.execute("truncate nse.write_benchmark;")
+        start = time.perf_counter()
+        psql_conn.copy_rows("nse.write_benchmark", columns,
+                            ([item.get(api_key) for api_key in api_keys] for item in rows))
+        copy_time = time.perf_counter() - start
+    finally:
+        psql_conn.execute("drop table if exists nse.write_benchmark;")
+    return insert_time, copy_time
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the string-built INSERT path with the COPY bulk loader.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="Row counts to benchmark (default: 10000 100000)")
+    parser.add_argument("--live", action="store_true", help="Also load the rows into a scratch table in the local datadump database")
+    args = parser.parse_args()
+
+    psql_conn = None
+    if args.live:
+        psql_conn = PGConn({
+                    "database": "datadump",
+                    "host": "localhost",
+                    "port": "5432",
+                    "user": "sparsh",
+                    "password": "algobulls"
+                })
+
+    for count in args.rows:
+        rows = make_synthetic_rows(count)
+        insert_time, insert_bytes = bench_insert_build(rows)
+        copy_time, copy_bytes = bench_copy_encode(rows)
+        print(f"{count} rows:")
+        print(f"  INSERT build:           {insert_time:.3f}s ({insert_bytes / 1e6:.1f} MB of SQL)")
+        print(f"  COPY stream encode:     {copy_time:.3f}s ({copy_bytes / 1e6:.1f} MB streamed)")
+        loop_time, mapper_time = bench_row_mapping(rows)
+        _, typed_time = bench_row_mapping(rows, {"date": "timestamp"})
+        print(f"  Row mapping (dict.get): {loop_time:.3f}s")
+        print(f"  Row mapping (mapper):   {mapper_time:.3f}s ({typed_time:.3f}s with date normalization)")
+        if psql_conn is not None:
+            live_insert, live_copy = bench_live(psql_conn, rows)
+            print(f"  INSERT end-to-end:      {live_insert:.3f}s ({count / live_insert:,.0f} rows/s)")
+            print(f"  COPY end-to-end:        {live_copy:.3f}s ({count / live_copy:,.0f} rows/s)")
+
+if __name__ == "__main__":
+    main()
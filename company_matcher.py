@@ -0,0 +1,117 @@
+import re
+from collections import Counter
+from difflib import SequenceMatcher
+
+try:
+    from rapidfuzz import fuzz
+except ImportError:
+    fuzz = None
+
+_PUNCTUATION = re.compile(r"[^a-z0-9 ]+")
+_SPACES = re.compile(r"\s+")
+_LEGAL_SUFFIX = re.compile(r"(?:\s+(?:limited|ltd))+$")
+
+def normalize_name(name):
+    """Lowercase, drop punctuation and a trailing "Limited"/"Ltd" so spelling variants share a key"""
+    name = name.lower().replace("&", " and ")
+    name = _SPACES.sub(" ", _PUNCTUATION.sub(" ", name)).strip()
+    return _LEGAL_SUFFIX.sub("", name)
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def ratio(a, b):
+    """Edit-based similarity in [0, 1], the same measure as difflib's ratio()"""
+    if fuzz is not None:
+        return fuzz.ratio(a, b) / 100
+    return SequenceMatcher(None, a, b).ratio()
+
+def token_set_ratio(a, b):
+    """Word-order and subset tolerant similarity in [0, 1]"""
+    if fuzz is not None:
+        return fuzz.token_set_ratio(a, b) / 100
+    tokens_a, tokens_b = set(a.split()), set(b.split())
+    common = " ".join(sorted(tokens_a & tokens_b))
+    rest_a = " ".join(sorted(tokens_a - tokens_b))
+    rest_b = " ".join(sorted(tokens_b - tokens_a))
+    combined_a = f"{common} {rest_a}".strip()
+    combined_b = f"{common} {rest_b}".strip()
+    scores = [ratio(combined_a, combined_b)]
+    if common:
+        scores += [ratio(common, combined_a), ratio(common, combined_b)]
+    return max(scores)
+
+SCORERS = {"ratio": ratio, "token_set": token_set_ratio}
+
+class CompanyNameIndex:
+    """Prebuilt lookup from free-text company names to (company_name, symbol).
+
+    Names resolve through an exact dict on the normalized name first. Otherwise
+    a trigram inverted index picks the `top_k` names sharing the most trigrams,
+    and only those are scored. The best one is returned if it scores at least
+    `threshold`.
+
+    DEFAULT_THRESHOLD is calibrated with benchmark_company_matcher.py --labels:
+    below it, near-miss names of other companies ("Neuland Laboratories" ->
+    "IPCA Laboratories") outnumber the extra correct matches.
+    """
+
+    DEFAULT_THRESHOLD = 0.85
+
+    def __init__(self, name_to_symbol, threshold=None, top_k=20, scorer="ratio"):
+        self.threshold = self.DEFAULT_THRESHOLD if threshold is None else threshold
+        self.top_k = top_k
+        self.scorer_name = scorer
+        self.scorer = SCORERS[scorer]
+        self.names = []
+        self.normalized = []
+        self.symbols = []
+        self.exact = {}
+        self.postings = {}
+        for name, symbol in name_to_symbol.items():
+            if not name:
+                continue
+            name_id = len(self.names)
+            key = normalize_name(name)
+            self.names.append(name)
+            self.normalized.append(key)
+            self.symbols.append(symbol)
+            self.exact.setdefault(key, name_id)
+            for gram in trigrams(key):
+                self.postings.setdefault(gram, []).append(name_id)
+        self.gram_counts = [len(trigrams(key)) for key in self.normalized]
+
+    def __len__(self):
+        return len(self.names)
+
+    def candidates(self, key):
+        """Ids of the `top_k` names closest to `key` by trigram overlap (Dice coefficient)"""
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        if not shared:
+            return []
+        size = len(grams)
+        ranked = sorted(shared.items(), key=lambda item: (-2 * item[1] / (size + self.gram_counts[item[0]]), item[0]))
+        return [name_id for name_id, _ in ranked[:self.top_k]]
+
+    def match(self, company_name):
+        """(company_name, symbol, score) of the best match, or (None, None, score) below the threshold"""
+        if not company_name:
+            return None, None, 0.0
+        # The result depends only on the normalized name, so callers can memoize on it
+        key = normalize_name(company_name)
+        name_id = self.exact.get(key)
+        if name_id is not None:
+            return self.names[name_id], self.symbols[name_id], 1.0
+
+        best_id, best_score = None, 0.0
+        for candidate_id in self.candidates(key):
+            score = self.scorer(key, self.normalized[candidate_id])
+            if score > best_score:
+                best_id, best_score = candidate_id, score
+        if best_id is None or best_score < self.threshold:
+            return None, None, best_score
+        return self.names[best_id], self.symbols[best_id], best_score
@@ -1,11 +1,53 @@
 from postgres_utils import PGConn
+from company_matcher import CompanyNameIndex, normalize_name
+from resolution_cache import ResolutionCache
+import multiprocessing
 import re
-from difflib import SequenceMatcher
+from concurrent.futures import ProcessPoolExecutor
+
+# Set in each worker process, inherited on fork or sent once by _init_resolver
+_worker_resolver = None
+
+def _init_resolver(resolver):
+    global _worker_resolver
+    if resolver is not None:
+        _worker_resolver = resolver
+
+def _resolve_chunk(videos):
+    return _worker_resolver._resolve(videos)
 
 class ConferenceCall:
-    def __init__(self, psql_conn):
+    _TITLE_PREFIX = r'(?:Earnings Call|Live:|Management Call|#|Q\dFY\d\d|Press Conference|Deleted on|Webinar:)\s+'
+    _TITLE_SUFFIX = r'(?:\s+Earnings\s+Call|\s+Q&A|\s+:|\s+Investor\s+Call|\s+Conference\s+Call|\s+Webinar|\s+Business\s+Update|\s+Management\s+Call|\s+Press\s+Conference|\s+Analyst\s+Meeting|\s+IPO:|\s+\||\s+Capital\s+Markets\s+Day)'
+    # Leading tag and company name in one pass. The tag is consumed atomically
+    # (a lookahead capture, then a backreference) so the name can never start
+    # inside a tag, the same as stripping the tag first.
+    _TITLE_PATTERN = re.compile(
+        rf'^(?:(?=(?P<prefix>{_TITLE_PREFIX}))(?P=prefix)|(?!{_TITLE_PREFIX}))(?P<name>.*?){_TITLE_SUFFIX}',
+        re.IGNORECASE)
+    _LIMITED_FOR_QUARTER = re.compile(r'\s+(Ltd\.|Limited)(\s+for\s+Q)')
+    _TICKER_SUFFIX = re.compile(r'\s+\([A-Z]+\)$')
+    _PART_NUMBER = re.compile(r'\s+Part\s+\d+:')
+
+    def __init__(self, psql_conn, company_name_to_symbol_map=None, processes=None, min_parallel_videos=2000,
+                 cache_resolutions=True):
+        """`processes` > 1 resolves pending titles on a process pool once there
+        are at least `min_parallel_videos` of them. With `cache_resolutions`,
+        name matches are remembered across runs in trendlyne.company_name_resolutions."""
         self.psql_conn = psql_conn
-        self.company_name_to_symbol_map = self._company_name_to_symbol_map()
+        self.processes = processes
+        self.min_parallel_videos = min_parallel_videos
+        if company_name_to_symbol_map is None:
+            company_name_to_symbol_map = self._company_name_to_symbol_map()
+        self.company_name_to_symbol_map = company_name_to_symbol_map
+        self.name_index = CompanyNameIndex(self.company_name_to_symbol_map)
+        self.resolution_cache = None
+        if cache_resolutions and psql_conn is not None:
+            fingerprint = ResolutionCache.metadata_fingerprint(self.company_name_to_symbol_map, self.name_index.threshold,
+                                                               self.name_index.top_k, self.name_index.scorer_name)
+            self.resolution_cache = ResolutionCache(psql_conn, fingerprint)
+            self.resolution_cache.ensure_table()
+            print(f"Loaded {self.resolution_cache.load()} cached company name resolutions")
 
     def _company_name_to_symbol_map(self):
         sql = """select company_name, symbol from nse.metadata;"""
@@ -13,65 +55,152 @@ class ConferenceCall:
         return {row[0]: row[1] for row in result}
 
     def _extract_company_name(self, title):
-        prefix_pattern = r'^(Earnings Call|Live:|Management Call|#|Q\dFY\d\d|Press Conference|Deleted on|Webinar:)\s+'
-        clean_title = re.sub(prefix_pattern, '', title, flags=re.IGNORECASE)
-        company_pattern = r'^(.*?)(?:\s+Earnings\s+Call|\s+Q&A|\s+:|\s+Investor\s+Call|\s+Conference\s+Call|\s+Webinar|\s+Business\s+Update|\s+Management\s+Call|\s+Press\s+Conference|\s+Analyst\s+Meeting|\s+IPO:|\s+\||\s+Capital\s+Markets\s+Day)'
-        match = re.search(company_pattern, clean_title, re.IGNORECASE)
-        if match:
-            company_name = match.group(1).strip()
-            company_name = re.sub(r'\s+(Ltd\.|Limited)(\s+for\s+Q)', r' \2', company_name)
-            if "Call with" in company_name:
-                company_name = company_name.split("Call with")[0].strip()
-            elif "Call between" in company_name:
-                company_name = company_name.split("Call between")[0].strip()
-            company_name = re.sub(r'\s+\([A-Z]+\)$', '', company_name)
-            company_name = re.sub(r'\s+Part\s+\d+:', '', company_name)
-            return company_name
-        
-        return None
-    
-    def _update_conference_calls_table(self):
+        match = self._TITLE_PATTERN.match(title)
+        if match is None:
+            return None
+        company_name = match.group("name").strip()
+        if "for" in company_name:
+            company_name = self._LIMITED_FOR_QUARTER.sub(r' \2', company_name)
+        split_at = company_name.find("Call with")
+        if split_at < 0:
+            split_at = company_name.find("Call between")
+        if split_at >= 0:
+            company_name = company_name[:split_at].strip()
+        if company_name.endswith(")"):
+            company_name = self._TICKER_SUFFIX.sub('', company_name)
+        if "Part" in company_name:
+            company_name = self._PART_NUMBER.sub('', company_name)
+        return company_name
+
+    def _extract_company_names(self, titles):
+        """_extract_company_name over an iterable of titles, in order"""
+        extract = self._extract_company_name
+        return [extract(title or "") for title in titles]
+
+    def _pending_videos(self):
+        """(video_id, video_title) of the videos still missing a company"""
         sql = """
-            select 
-                distinct(video_id, video_title) 
-            from 
-                trendlyne.conference_calls 
-            where 
+            select distinct
+                video_id, video_title
+            from
+                trendlyne.conference_calls
+            where
                 company_name is null or company_symbol is null;
             """
-        result = self.psql_conn.execute(sql)
-        print(f"Found {len(result)} videos to process")
-
-        for row in result:
-            combined_str = row[0]
-            parts = combined_str.strip('()').split(',', 1)
-            video_id = parts[0].strip('"\'')
-            video_title = parts[1].strip('"\'')
-            print(f"Processing video: {video_title}")
-            extracted_name = self._extract_company_name(video_title)
-            if extracted_name:
-                mapped_name, company_symbol = self._get_company_from_name(extracted_name)
-                if mapped_name and company_symbol:
-                    escaped_extracted = extracted_name.replace("'", "''")
-                    escaped_mapped = mapped_name.replace("'", "''")
-                    sql_query = f"""
-                    update trendlyne.conference_calls
-                    set extracted_company_name = '{escaped_extracted}',
-                        company_name = '{escaped_mapped}',
-                        company_symbol = '{company_symbol}'
-                    where video_id = '{video_id}';
-                    """
-                    self.psql_conn.execute(sql_query)
-            else:
-                sql_query = f"""
-                update trendlyne.conference_calls
-                set extracted_company_name = NULL,
-                    company_name = NULL,
-                    company_symbol = NULL
-                where video_id = '{video_id}';
-                """
-                self.psql_conn.execute(sql_query)
-    
+        return [(row[0], row[1]) for row in self.psql_conn.execute(sql) or []]
+
+    def _match_name(self, extracted_name, resolutions):
+        """(company_name, symbol, score) from the resolution cache, this run's matches, or the index"""
+        name_key = normalize_name(extracted_name)
+        resolution = self.resolution_cache.get(name_key) if self.resolution_cache is not None else None
+        if resolution is None:
+            resolution = resolutions.get(name_key)
+        if resolution is None:
+            resolution = resolutions[name_key] = self.name_index.match(extracted_name)
+        return resolution
+
+    def _resolve(self, videos):
+        """(video_id, extracted_name, company_name, symbol) updates for the videos,
+        plus the names newly matched along the way (normalized name -> resolution).
+
+        Titles with no extractable name clear the company columns; names that
+        don't match a company leave the row untouched.
+        """
+        updates = {}
+        resolutions = {}
+        extracted_names = self._extract_company_names(video_title for _, video_title in videos)
+        for (video_id, _), extracted_name in zip(videos, extracted_names):
+            if not extracted_name:
+                updates[video_id] = (video_id, None, None, None)
+                continue
+            mapped_name, company_symbol, _ = self._match_name(extracted_name, resolutions)
+            if mapped_name and company_symbol:
+                updates[video_id] = (video_id, extracted_name, mapped_name, company_symbol)
+        return list(updates.values()), resolutions
+
+    def __getstate__(self):
+        # Workers only resolve names, so the database connection stays behind
+        state = self.__dict__.copy()
+        state["psql_conn"] = None
+        return state
+
+    def _resolve_parallel(self, videos):
+        """_resolve split across a process pool, merged in the original order"""
+        global _worker_resolver
+        if not videos:
+            return [], {}
+        chunk_count = max(1, self.processes or 1) * 4
+        chunk_size = max(1, -(-len(videos) // chunk_count))
+        chunks = [videos[i:i + chunk_size] for i in range(0, len(videos), chunk_size)]
+        start_methods = multiprocessing.get_all_start_methods()
+        if "fork" in start_methods:
+            # Forked workers inherit the index from this process, nothing is pickled
+            context = multiprocessing.get_context("fork")
+            _worker_resolver = self
+            initargs = (None,)
+        else:
+            context = multiprocessing.get_context()
+            initargs = (self,)
+        try:
+            with ProcessPoolExecutor(max_workers=self.processes, mp_context=context,
+                                     initializer=_init_resolver, initargs=initargs) as executor:
+                updates = {}
+                resolutions = {}
+                for chunk_updates, chunk_resolutions in executor.map(_resolve_chunk, chunks):
+                    for update in chunk_updates:
+                        updates[update[0]] = update
+                    resolutions.update(chunk_resolutions)
+        finally:
+            _worker_resolver = None
+        return list(updates.values()), resolutions
+
+    def _apply_updates(self, updates):
+        """Write all the updates with one COPY into a staging table and one UPDATE ... FROM"""
+        if not updates:
+            return 0
+        staging_name = "stage_conference_call_companies"
+        # The staging table is a temp table, so every step must use the same connection
+        with self.psql_conn.lease():
+            self.psql_conn.execute(f"""
+                create temp table if not exists {staging_name} (
+                    video_id varchar(255),
+                    extracted_company_name text,
+                    company_name text,
+                    company_symbol varchar(255)
+                );""")
+            self.psql_conn.execute(f"truncate {staging_name};")
+            self.psql_conn.copy_rows(staging_name, ["video_id", "extracted_company_name", "company_name", "company_symbol"], updates)
+            result = self.psql_conn.execute(f"""
+                with updated as (
+                    update trendlyne.conference_calls c
+                    set extracted_company_name = s.extracted_company_name,
+                        company_name = s.company_name,
+                        company_symbol = s.company_symbol
+                    from {staging_name} s
+                    where c.video_id = s.video_id
+                    returning 1
+                )
+                select count(*) from updated;""")
+        if not result:
+            raise RuntimeError(f"Update from {staging_name} into trendlyne.conference_calls failed")
+        return result[0][0]
+
+    def _update_conference_calls_table(self):
+        videos = self._pending_videos()
+        print(f"Found {len(videos)} videos to process")
+        if self.processes and self.processes > 1 and len(videos) >= self.min_parallel_videos:
+            updates, resolutions = self._resolve_parallel(videos)
+        else:
+            updates, resolutions = self._resolve(videos)
+        matched = sum(1 for update in updates if update[2])
+        print(f"Matched {matched} videos to a company, clearing {len(updates) - matched} without a company name")
+        rows_updated = self._apply_updates(updates)
+        print(f"Updated {rows_updated} rows in trendlyne.conference_calls")
+        if self.resolution_cache is not None:
+            self.resolution_cache.update(resolutions)
+            print(f"Matched {len(resolutions)} new company names, saved {self.resolution_cache.save()} to the resolution cache")
+        return rows_updated
+
     def _get_videos_with_no_company_name(self, file_path=None):
         sql = """select video_id, video_title from trendlyne.conference_calls where company_name is null;"""
         result = self.psql_conn.execute(sql)
@@ -83,27 +212,8 @@ class ConferenceCall:
             return [(row[0], row[1]) for row in result]
 
     def _get_company_from_name(self, company_name):
-        normalised_input = company_name.lower()
-        for name, symbol in self.company_name_to_symbol_map.items():
-            if normalised_input == name.lower():
-                return name, symbol
-        
-        company_names = list(self.company_name_to_symbol_map.keys())
-        best_match = self._get_best_match(normalised_input, company_names, threshold=0.6)
-
-        if best_match:
-            return best_match, self.company_name_to_symbol_map[best_match]
-    
-        return None, None
-
-    def _get_best_match(self, input_string, string_list, threshold = 0.7):
-        def similarity(a, b):
-            return SequenceMatcher(None, a, b).ratio()
-        scores = [(s, similarity(input_string, s)) for s in string_list]
-        best_match, best_score = max(scores, key=lambda pair: pair[1], default=('', 0))
-        return best_match if best_score >= threshold else ''
-
-        
+        mapped_name, company_symbol, _ = self.name_index.match(company_name)
+        return mapped_name, company_symbol
 
 if __name__ == "__main__":
     pgconn = PGConn({
@@ -113,6 +223,6 @@ if __name__ == "__main__":
                 "user": "sparsh",
                 "password": "algobulls"
             })
-    cc = ConferenceCall(pgconn)
+    cc = ConferenceCall(pgconn, processes=multiprocessing.cpu_count())
     cc._update_conference_calls_table()
     # cc.get_videos_with_no_company_name("videos_with_no_company_name.txt")
\ No newline at end of file
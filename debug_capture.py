@@ -0,0 +1,93 @@
+import datetime
+import itertools
+import json
+import os
+import queue
+import threading
+
+class DebugCapture:
+    """Sampled, asynchronous capture of write batches for debugging and replay.
+
+    Failed batches are always saved with their error; with `sample_every=N`
+    one in N successful batches is saved as well. Files are JSON documents
+    written by a background thread into `directory`, keeping only the newest
+    `max_files` of each. When the writer falls behind, sampled captures are dropped
+    rather than slowing the write path.
+    """
+
+    def __init__(self, directory="debug_capture", sample_every=0, max_files=500, queue_size=32):
+        self.directory = directory
+        self.sample_every = sample_every
+        self.max_files = max_files
+        self.batch_counter = itertools.count(1)
+        self.file_counter = itertools.count(1)
+        self.dropped = 0
+        self.queue = queue.Queue(maxsize=queue_size)
+        os.makedirs(directory, exist_ok=True)
+        self.writer_thread = threading.Thread(target=self._write_loop, name="debug-capture", daemon=True)
+        self.writer_thread.start()
+
+    def should_sample(self):
+        """Whether the next successful batch is one of the 1 in `sample_every` to capture"""
+        return bool(self.sample_every) and next(self.batch_counter) % self.sample_every == 0
+
+    def capture(self, kind, table_name, rows, columns=None, error=None, sql=None):
+        """Queue a batch to be written. `kind` is "api_rows" (raw API dicts) or
+        "mapped_rows" (value lists ordered like `columns`)."""
+        record = {
+            "kind": kind,
+            "table": table_name,
+            "captured_at": datetime.datetime.now().isoformat(),
+            "error": error,
+            "columns": columns,
+            "rows": rows,
+            "sql": sql
+        }
+        if error is not None:
+            # Failures are the point of the capture, so wait for room
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        while True:
+            record = self.queue.get()
+            try:
+                self._write(record)
+            except Exception as e:
+                print(f"Error writing debug capture: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _write(self, record):
+        status = "failed" if record["error"] is not None else "sampled"
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        file_name = f"{timestamp}_{next(self.file_counter):06d}_{record['table']}_{status}.json"
+        path = os.path.join(self.directory, file_name)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(record, f, default=str)
+        os.replace(f"{path}.tmp", path)
+        self._rotate(status)
+
+    def _rotate(self, status):
+        # Sampled and failed batches rotate separately, so samples never push out a failure
+        files = sorted(name for name in os.listdir(self.directory) if name.endswith(f"_{status}.json"))
+        for name in files[:max(0, len(files) - self.max_files)]:
+            os.remove(os.path.join(self.directory, name))
+
+    def flush(self):
+        """Block until every queued capture is on disk"""
+        self.queue.join()
+
+    def failed_captures(self):
+        """Paths of the saved failed batches, oldest first"""
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                if name.endswith("_failed.json")]
+
+    @staticmethod
+    def load(path):
+        with open(path, "r") as f:
+            return json.load(f)
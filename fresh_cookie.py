@@ -6,6 +6,7 @@ import time
 import os
 from typing import Dict, Any, Optional
 import urllib.parse
+from retry_policy import RetryPolicy
 
 def get_fresh_cookies(debug: bool = False, max_retries: int = 3) -> requests.Session:
     session = requests.Session()
@@ -94,6 +95,7 @@ def fetch_corporate_pit(symbol: str, company_name: str = None, use_cookies: bool
     }
     session = None
     last_error = None
+    retry_policy = RetryPolicy(max_attempts=max_retries)
     for attempt in range(max_retries):
         try:
             if use_cookies:
@@ -130,7 +132,7 @@ def fetch_corporate_pit(symbol: str, company_name: str = None, use_cookies: bool
                     print(f"Response content (first 500 chars): {response.text[:500]}")
             if not response.content:
                 print(f"Attempt {attempt+1}/{max_retries}: Empty response received")
-                time.sleep(2)
+                time.sleep(retry_policy.backoff(attempt))
                 continue
             else:
                 try:
@@ -142,12 +144,14 @@ def fetch_corporate_pit(symbol: str, company_name: str = None, use_cookies: bool
                         print(f"Full response content: {response.text}")
                     if "<html" in response.text.lower():
                         print("Received HTML instead of JSON - might be a captcha or login page")
-                    time.sleep(2)
+                        session = None
+                    time.sleep(retry_policy.backoff(attempt))
                     continue
         except requests.exceptions.RequestException as e:
             print(f"Attempt {attempt+1}/{max_retries}: Error during request: {e}")
             last_error = e
-            time.sleep(2 * (attempt + 1))
+            retry_after = e.response.headers.get("Retry-After") if e.response is not None else None
+            time.sleep(retry_policy.backoff(attempt, retry_after))
             session = None
             continue
     print(f"Failed to fetch data after {max_retries} attempts. Last error: {last_error}")
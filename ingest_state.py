@@ -0,0 +1,154 @@
+import datetime
+import json
+
+DATE_FORMAT = "%d-%m-%Y"
+
+class IngestStateStore:
+    """Checkpoint store for NSEDataFetcher backed by the nse.ingest_state table.
+
+    Every completed request is recorded as (endpoint, param_key, from_date,
+    to_date). Planning then only generates windows for the gaps that are not
+    covered yet, so a rerun fetches the delta and a crashed run resumes.
+    Requests without a date window are treated as complete for
+    `undated_ttl_hours` after they last succeeded.
+    """
+
+    def __init__(self, psql_conn, table_name="nse.ingest_state", undated_ttl_hours=24):
+        self.psql_conn = psql_conn
+        self.table_name = table_name
+        self.undated_ttl = datetime.timedelta(hours=undated_ttl_hours)
+        self.state = {}
+
+    def ensure_table(self):
+        sql = f"""
+            create table if not exists {self.table_name} (
+                endpoint varchar(255) not null,
+                param_key text not null,
+                from_date date,
+                to_date date,
+                rows_inserted int,
+                completed_at timestamp default now()
+            );
+            create index if not exists ingest_state_endpoint_idx on {self.table_name} (endpoint, param_key);
+            """
+        self.psql_conn.execute(sql)
+
+    @staticmethod
+    def param_key(request_params):
+        """Canonical key for the non-date params of a request"""
+        return json.dumps({k: v for k, v in request_params.items() if k not in ("from_date", "to_date")}, sort_keys=True)
+
+    @staticmethod
+    def _escape(value):
+        return value.replace("'", "''")
+
+    def load(self, endpoint_name):
+        """Load the recorded state for one endpoint into memory"""
+        sql = f"""
+            select param_key, from_date, to_date, completed_at
+            from {self.table_name}
+            where endpoint = '{self._escape(endpoint_name)}';
+            """
+        result = self.psql_conn.execute(sql) or []
+        state = {}
+        for param_key, from_date, to_date, completed_at in result:
+            state.setdefault(param_key, []).append((from_date, to_date, completed_at))
+        self.state[endpoint_name] = state
+        return state
+
+    def _entries(self, endpoint_name, request_params):
+        if endpoint_name not in self.state:
+            self.load(endpoint_name)
+        return self.state[endpoint_name].get(self.param_key(request_params), [])
+
+    @staticmethod
+    def _merge(ranges):
+        """Merge (from, to) date ranges that overlap or touch"""
+        merged = []
+        for from_date, to_date in sorted(ranges):
+            if merged and from_date <= merged[-1][1] + datetime.timedelta(days=1):
+                merged[-1] = (merged[-1][0], max(merged[-1][1], to_date))
+            else:
+                merged.append((from_date, to_date))
+        return merged
+
+    def missing_ranges(self, endpoint_name, request_params, from_date, to_date):
+        """Return the (from_date, to_date) string pairs inside the period that are not covered yet"""
+        start = datetime.datetime.strptime(from_date, DATE_FORMAT).date()
+        end = datetime.datetime.strptime(to_date, DATE_FORMAT).date()
+        covered = self._merge([(f, t) for f, t, _ in self._entries(endpoint_name, request_params) if f and t])
+
+        gaps = []
+        cursor = start
+        for covered_from, covered_to in covered:
+            if covered_to < cursor:
+                continue
+            if covered_from > end:
+                break
+            if covered_from > cursor:
+                gaps.append((cursor, covered_from - datetime.timedelta(days=1)))
+            cursor = covered_to + datetime.timedelta(days=1)
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return [(f.strftime(DATE_FORMAT), t.strftime(DATE_FORMAT)) for f, t in gaps]
+
+    def is_complete(self, endpoint_name, request_params):
+        """Whether an undated request succeeded recently enough to skip"""
+        cutoff = datetime.datetime.now() - self.undated_ttl
+        return any(f is None and completed_at and completed_at >= cutoff
+                   for f, _, completed_at in self._entries(endpoint_name, request_params))
+
+    def mark_complete(self, endpoint_name, request_params, rows_inserted):
+        """Record a successfully written request.
+
+        Windows reaching today are clamped to yesterday, since NSE may still
+        publish filings for the current day.
+        """
+        param_key = self.param_key(request_params)
+        from_date = request_params.get("from_date")
+        to_date = request_params.get("to_date")
+        now = datetime.datetime.now()
+        if from_date and to_date:
+            from_day = datetime.datetime.strptime(from_date, DATE_FORMAT).date()
+            to_day = datetime.datetime.strptime(to_date, DATE_FORMAT).date()
+            last_complete_day = now.date() - datetime.timedelta(days=1)
+            to_day = min(to_day, last_complete_day)
+            if to_day < from_day:
+                return
+            date_values = f"'{from_day.isoformat()}', '{to_day.isoformat()}'"
+        else:
+            from_day = to_day = None
+            date_values = "NULL, NULL"
+
+        sql = f"""
+            insert into {self.table_name} (endpoint, param_key, from_date, to_date, rows_inserted, completed_at)
+            values ('{self._escape(endpoint_name)}', '{self._escape(param_key)}', {date_values}, {int(rows_inserted)}, '{now.isoformat()}');
+            """
+        self.psql_conn.execute(sql)
+        self.state.setdefault(endpoint_name, {}).setdefault(param_key, []).append((from_day, to_day, now))
+
+    def compact(self, endpoint_name):
+        """Collapse the recorded windows of an endpoint into merged ranges"""
+        state = self.load(endpoint_name)
+        values = []
+        for param_key, entries in state.items():
+            dated = [(f, t) for f, t, _ in entries if f and t]
+            undated = [completed_at for f, _, completed_at in entries if f is None]
+            for from_day, to_day in self._merge(dated):
+                values.append(f"('{self._escape(endpoint_name)}', '{self._escape(param_key)}', "
+                              f"'{from_day.isoformat()}', '{to_day.isoformat()}', NULL, now())")
+            if undated:
+                values.append(f"('{self._escape(endpoint_name)}', '{self._escape(param_key)}', "
+                              f"NULL, NULL, NULL, '{max(undated).isoformat()}')")
+        if not values:
+            return
+        # A single statement keeps the delete and re-insert atomic under autocommit
+        sql = f"""
+            with deleted as (
+                delete from {self.table_name} where endpoint = '{self._escape(endpoint_name)}'
+            )
+            insert into {self.table_name} (endpoint, param_key, from_date, to_date, rows_inserted, completed_at)
+            values {', '.join(values)};
+            """
+        self.psql_conn.execute(sql)
+        self.load(endpoint_name)
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import socket
+import threading
+
+class JobQueue:
+    """Persistent work queue for NSEDataFetcher backed by the nse.fetch_jobs table.
+
+    Each request of a run's plan is stored as a job with a status (pending,
+    running, done, failed), an attempt count and timings. Workers claim jobs
+    with `for update skip locked`, so several processes can drain the same run,
+    and jobs left running by a crashed worker go back to pending once their
+    lease expires.
+
+    Jobs are also keyed by a plan key, the hash of the endpoint config a plan
+    was built from. Processes running the same config share its jobs, while
+    processes given different slices of an endpoint (ShardedRunner shards)
+    each enqueue and drain their own.
+    """
+
+    def __init__(self, psql_conn, run_id, table_name="nse.fetch_jobs", claim_batch=100, max_attempts=3, lease_seconds=900):
+        self.psql_conn = psql_conn
+        self.run_id = run_id
+        self.table_name = table_name
+        self.claim_batch = claim_batch
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.claimed = {}
+        self.claimed_lock = threading.Lock()
+        self.plan_keys = {}
+
+    def ensure_table(self):
+        sql = f"""
+            create table if not exists {self.table_name} (
+                id bigserial primary key,
+                run_id varchar(255) not null,
+                endpoint varchar(255) not null,
+                plan_key varchar(32) not null default '',
+                params text not null,
+                status varchar(16) not null default 'pending',
+                attempts int not null default 0,
+                rows_inserted int,
+                worker varchar(255),
+                enqueued_at timestamp not null default now(),
+                started_at timestamp,
+                finished_at timestamp
+            );
+            alter table {self.table_name} add column if not exists plan_key varchar(32) not null default '';
+            drop index if exists fetch_jobs_claim_idx;
+            create index if not exists fetch_jobs_plan_claim_idx on {self.table_name} (run_id, endpoint, plan_key, status);
+            """
+        self.psql_conn.execute(sql)
+
+    @staticmethod
+    def _escape(value):
+        return value.replace("'", "''")
+
+    @staticmethod
+    def job_key(request_params):
+        return json.dumps(request_params, sort_keys=True)
+
+    def set_plan(self, endpoint_name, plan_config):
+        """Scope the endpoint's jobs to the plan built from `plan_config` (params plus anything else shaping it)"""
+        self.plan_keys[endpoint_name] = hashlib.md5(self.job_key(plan_config).encode("utf-8")).hexdigest()
+
+    def _where(self, endpoint_name):
+        plan_key = self.plan_keys.get(endpoint_name, "")
+        return (f"run_id = '{self._escape(self.run_id)}' and endpoint = '{self._escape(endpoint_name)}' "
+                f"and plan_key = '{plan_key}'")
+
+    def has_jobs(self, endpoint_name):
+        result = self.psql_conn.execute(f"select 1 from {self.table_name} where {self._where(endpoint_name)} limit 1;")
+        return bool(result)
+
+    def enqueue(self, endpoint_name, plan):
+        """Stream a lazily generated plan into the queue with COPY and return the job count"""
+        plan_key = self.plan_keys.get(endpoint_name, "")
+        rows = ([self.run_id, endpoint_name, plan_key, self.job_key(request_params)] for request_params in plan)
+        return self.psql_conn.copy_rows(self.table_name, ["run_id", "endpoint", "plan_key", "params"], rows)
+
+    def enqueue_once(self, endpoint_name, plan):
+        """Enqueue the plan unless its jobs already exist and return the job count, or None if they did.
+
+        The check and the COPY run in one transaction holding an advisory lock
+        on the run, endpoint and plan key, so processes starting together on
+        the same config enqueue its plan only once.
+        """
+        lock_key = self._escape(f"{self.run_id}|{endpoint_name}|{self.plan_keys.get(endpoint_name, '')}")
+        with self.psql_conn.transaction():
+            self.psql_conn.execute(f"select pg_advisory_xact_lock(hashtext('{lock_key}'));")
+            if self.has_jobs(endpoint_name):
+                return None
+            return self.enqueue(endpoint_name, plan)
+
+    def requeue_stale(self, endpoint_name):
+        """Return jobs whose worker stopped before finishing them to the queue"""
+        sql = f"""
+            update {self.table_name}
+            set status = case when attempts >= {self.max_attempts} then 'failed' else 'pending' end
+            where {self._where(endpoint_name)} and status = 'running'
+            and started_at < now() - interval '{int(self.lease_seconds)} seconds';
+            """
+        self.psql_conn.execute(sql)
+
+    def claim(self, endpoint_name):
+        """Mark up to `claim_batch` pending jobs as running for this worker and return their params"""
+        sql = f"""
+            update {self.table_name}
+            set status = 'running', attempts = attempts + 1, started_at = now(), finished_at = null, worker = '{self._escape(self.worker)}'
+            where id in (
+                select id from {self.table_name}
+                where {self._where(endpoint_name)} and status = 'pending'
+                order by id
+                limit {int(self.claim_batch)}
+                for update skip locked
+            )
+            returning id, params;
+            """
+        result = self.psql_conn.execute(sql) or []
+        jobs = []
+        with self.claimed_lock:
+            for job_id, params in sorted(result):
+                self.claimed[(endpoint_name, params)] = job_id
+                jobs.append(json.loads(params))
+        return jobs
+
+    def complete(self, endpoint_name, request_params, rows_inserted):
+        with self.claimed_lock:
+            job_id = self.claimed.pop((endpoint_name, self.job_key(request_params)), None)
+        if job_id is None:
+            return
+        sql = f"""
+            update {self.table_name}
+            set status = 'done', rows_inserted = {int(rows_inserted)}, finished_at = now()
+            where id = {job_id};
+            """
+        self.psql_conn.execute(sql)
+
+    def release(self, endpoint_name):
+        """Give back the claimed jobs that did not complete, failing those out of attempts"""
+        with self.claimed_lock:
+            keys = [key for key in self.claimed if key[0] == endpoint_name]
+            job_ids = [self.claimed.pop(key) for key in keys]
+        if not job_ids:
+            return
+        sql = f"""
+            update {self.table_name}
+            set status = case when attempts >= {self.max_attempts} then 'failed' else 'pending' end, finished_at = now()
+            where id in ({', '.join(str(job_id) for job_id in job_ids)}) and status = 'running';
+            """
+        self.psql_conn.execute(sql)
+
+    def progress(self, endpoint_name=None):
+        """Job counts by status, throughput and ETA for the run (optionally one endpoint)"""
+        where = f"run_id = '{self._escape(self.run_id)}'"
+        if endpoint_name is not None:
+            where = self._where(endpoint_name)
+        sql = f"""
+            select
+                count(*) filter (where status = 'pending'),
+                count(*) filter (where status = 'running'),
+                count(*) filter (where status = 'done'),
+                count(*) filter (where status = 'failed'),
+                coalesce(sum(rows_inserted), 0),
+                avg(extract(epoch from finished_at - started_at)) filter (where status = 'done'),
+                extract(epoch from max(finished_at) - min(started_at))
+            from {self.table_name}
+            where {where};
+            """
+        result = self.psql_conn.execute(sql)
+        if not result:
+            return None
+        pending, running, done, failed, rows_inserted, avg_seconds, elapsed = result[0]
+        jobs_per_second = done / float(elapsed) if done and elapsed else None
+        eta_seconds = (pending + running) / jobs_per_second if jobs_per_second else None
+        return {
+            "pending": pending,
+            "running": running,
+            "done": done,
+            "failed": failed,
+            "rows_inserted": int(rows_inserted),
+            "avg_job_seconds": float(avg_seconds) if avg_seconds is not None else None,
+            "jobs_per_second": jobs_per_second,
+            "eta_seconds": eta_seconds
+        }
@@ -0,0 +1,174 @@
+import codecs
+import json
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+WHITESPACE = " \t\n\r"
+# Characters that can follow a complete value inside an array or object
+VALUE_END = WHITESPACE + ",]}"
+
+def iter_decoded_chunks(raw_chunks, content_encoding=""):
+    """Incrementally decompress a gzip/deflate/br encoded byte stream"""
+    content_encoding = (content_encoding or "").lower()
+    if "br" in content_encoding:
+        if brotli is None:
+            raise ValueError("brotli is required to decode br responses")
+        decompressor = brotli.Decompressor()
+        for chunk in raw_chunks:
+            if chunk:
+                yield decompressor.process(chunk)
+        return
+    if "gzip" in content_encoding or "deflate" in content_encoding:
+        wbits = 16 + zlib.MAX_WBITS if "gzip" in content_encoding else zlib.MAX_WBITS
+        decompressor = zlib.decompressobj(wbits)
+        for chunk in raw_chunks:
+            if chunk:
+                yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+        return
+    yield from raw_chunks
+
+class JSONArrayStream:
+    """Iterate the items of a JSON array without holding the whole document.
+
+    The array can be the top-level value or the value of `key` in a top-level
+    object (NSE returns both shapes). Items are decoded one at a time with
+    json.JSONDecoder.raw_decode as bytes arrive, so memory is bounded by the
+    largest single item rather than the response size. After iterating,
+    `found` tells whether the array was there at all, so an error payload or
+    `"data": null` can be told apart from an empty array.
+    """
+
+    def __init__(self, byte_chunks, key="data", compact_after=65536):
+        self.chunks = iter(byte_chunks)
+        self.key = key
+        self.compact_after = compact_after
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+        self.found = None
+
+    def _more(self):
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self.text_decoder.decode(b"", final=True)
+        else:
+            self.bytes_read += len(chunk)
+            text = self.text_decoder.decode(chunk)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+
+    def _peek(self):
+        """Skip whitespace and return the next character, or None at the end of input"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return None
+            self._more()
+
+    def _decode_value(self):
+        """Decode the JSON value at the current position, reading more input while it is incomplete"""
+        self._peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                # A bare number or literal is only complete once a delimiter follows it:
+                # "3.5" cut after "3" or "1.5e3" cut after "1.5" still decode as a prefix
+                if self.eof or (end < len(self.buffer) and
+                                (self.buffer[end] in VALUE_END or self.buffer[end - 1] in "\"]}")):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._more()
+
+    def _decode_key(self):
+        while True:
+            try:
+                key, end = json.decoder.scanstring(self.buffer, self.pos + 1)
+                self.pos = end
+                return key
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._more()
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def _seek_array(self):
+        """Position the stream just after the opening bracket of the target array"""
+        first = self._peek()
+        if first == "[":
+            self.pos += 1
+            return True
+        if first != "{":
+            return False
+        self.pos += 1
+        while True:
+            char = self._peek()
+            if char in ("}", None):
+                return False
+            if char == ",":
+                self.pos += 1
+                continue
+            key = self._decode_key()
+            self._expect(":")
+            if key == self.key and self._peek() == "[":
+                self.pos += 1
+                return True
+            self._decode_value()
+
+    def __iter__(self):
+        self.found = self._seek_array()
+        if not self.found:
+            return
+        while True:
+            char = self._peek()
+            if char is None:
+                raise json.JSONDecodeError("Unterminated array", self.buffer, self.pos)
+            if char == "]":
+                return
+            if char == ",":
+                self.pos += 1
+                continue
+            yield self._decode_value()
+            if self.pos > self.compact_after:
+                self.buffer = self.buffer[self.pos:]
+                self.pos = 0
+
+if __name__ == "__main__":
+    # Self-check: every chunk size must decode the same items, including
+    # numbers and literals split across chunk boundaries
+    documents = [
+        (b'[1, 2, 3.5]', [1, 2, 3.5]),
+        (b'[1.5e3]', [1500.0]),
+        (b'[-12, 0.25, true, false, null, "a,b", {"x": [1, 2.5e-3]}, 7]', [-12, 0.25, True, False, None, "a,b", {"x": [1, 0.0025]}, 7]),
+        (b'{"meta": {"n": 10.75}, "data": [{"a": 1}, 22.125, "s", 3e2], "total": 4}', [{"a": 1}, 22.125, "s", 300.0]),
+        (b'{"data" : [ 100 , -0.5 ]}', [100, -0.5])
+    ]
+    for document, expected in documents:
+        for size in range(1, len(document) + 1):
+            chunks = [document[i:i + size] for i in range(0, len(document), size)]
+            stream = JSONArrayStream(chunks)
+            items = list(stream)
+            assert stream.found and items == expected, (document, size, items)
+    for document in (b'{"error": "blocked"}', b'{"data": null}', b'{"data": {"a": 1}}'):
+        for size in (1, 3, len(document)):
+            stream = JSONArrayStream([document[i:i + size] for i in range(0, len(document), size)])
+            assert list(stream) == [] and stream.found is False, (document, size)
+    print("JSONArrayStream self-check passed")
@@ -44,6 +44,66 @@ create table trendlyne.conference_calls(
     financial_year varchar(255),
     playlist_id varchar(255),
     video_id varchar(255),
-    video_title text
+    video_title text,
+    extracted_company_name text,
+    company_name text,
+    company_symbol varchar(255)
 );
 
+
+create table nse.ingest_state (
+    endpoint varchar(255) not null,
+    param_key text not null,
+    from_date date,
+    to_date date,
+    rows_inserted int,
+    completed_at timestamp default now()
+);
+
+create index ingest_state_endpoint_idx on nse.ingest_state (endpoint, param_key);
+
+
+create table nse.fetch_jobs (
+    id bigserial primary key,
+    run_id varchar(255) not null,
+    endpoint varchar(255) not null,
+    plan_key varchar(32) not null default '',
+    params text not null,
+    status varchar(16) not null default 'pending',
+    attempts int not null default 0,
+    rows_inserted int,
+    worker varchar(255),
+    enqueued_at timestamp not null default now(),
+    started_at timestamp,
+    finished_at timestamp
+);
+
+create index fetch_jobs_plan_claim_idx on nse.fetch_jobs (run_id, endpoint, plan_key, status);
+
+
+create table trendlyne.company_name_resolutions (
+    name_key text primary key,
+    company_name text,
+    company_symbol varchar(255),
+    score double precision,
+    metadata_fingerprint varchar(32) not null,
+    resolved_at timestamp default now()
+);
+
+
+-- Natural-key migration for endpoints with "_natural_key" in config/schema.json.
+-- NaturalKeyWriter only detects these indexes at runtime; without one it falls back
+-- to a slower INSERT ... WHERE NOT EXISTS merge. Run once: drop existing duplicates
+-- (keeping the oldest row), then add the unique index backing ON CONFLICT. Rows with
+-- a NULL key column are never written by NaturalKeyWriter, so the index ignoring
+-- NULLs cannot let duplicates through.
+delete from nse.annualreports
+where ctid in (
+    select ctid from (
+        select ctid, row_number() over (partition by symbol, attachment_file order by ctid) as copy_number
+        from nse.annualreports
+    ) copies
+    where copy_number > 1
+);
+
+create unique index if not exists annualreports_natural_key_idx on nse.annualreports (symbol, attachment_file);
@@ -6,10 +6,184 @@ import datetime
 import time
 import random
 import os
+import threading
+import queue
+from itertools import islice, product
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from postgres_utils import PGConn
+from rate_limiter import TokenBucket
+from ingest_state import IngestStateStore
+from window_planner import AdaptiveWindowPlanner, WindowSizeStore
+from session_pool import SessionPool
+from response_cache import ResponseCache
+from json_stream import JSONArrayStream, iter_decoded_chunks
+from upsert_writer import NaturalKeyWriter
+from row_mapper import RowMapper
+from job_queue import JobQueue
+from retry_policy import RetryPolicy, SESSION_FAILURES
+import telemetry
+from debug_capture import DebugCapture
+from sinks import PostgresSink, ParquetSink
+
+class FetchPipeline:
+    """Staged fetch -> normalize -> batched write pipeline for one endpoint.
+
+    Fetch workers push payloads into a bounded queue, a normalize thread turns
+    them into column tuples using the schema map, and a writer thread merges
+    rows from many responses into one COPY per `batch_rows` rows or every
+    `flush_seconds`. Full queues block the stage before them, so the network
+    slows down when the database falls behind instead of buffering without
+    limit.
+    """
+
+    _DONE = object()
+
+    def __init__(self, fetcher, endpoint_name, schema_map, queue_size=64, batch_rows=5000, flush_seconds=2.0):
+        self.fetcher = fetcher
+        self.endpoint_name = endpoint_name
+        self.table_name = f"nse.{endpoint_name.lower()}"
+        self.row_mapper = fetcher._row_mapper(endpoint_name, schema_map)
+        self.columns = self.row_mapper.columns
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.fetch_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.buffer_rows = []
+        self.pending_requests = []
+        self.total_rows = 0
+
+    def run(self, plan, fetch):
+        """Run the plan through the pipeline and return the rows written"""
+        normalizer = threading.Thread(target=self._normalize_loop, name=f"{self.endpoint_name}-normalize")
+        writer = threading.Thread(target=self._write_loop, name=f"{self.endpoint_name}-writer")
+        normalizer.start()
+        writer.start()
+        
+        in_flight = threading.BoundedSemaphore(self.fetcher.max_workers * 2)
+        
+        def fetch_job(request_params):
+            try:
+                result = fetch(request_params)
+            except Exception as e:
+                self.fetcher._log_error(f"Worker error for {self.endpoint_name} with params {request_params}: {str(e)}")
+                result = None
+            try:
+                self.fetch_queue.put((request_params, result))
+            finally:
+                in_flight.release()
+        
+        try:
+            with ThreadPoolExecutor(max_workers=self.fetcher.max_workers) as executor:
+                for request_params in plan:
+                    in_flight.acquire()
+                    executor.submit(fetch_job, request_params)
+        finally:
+            self.fetch_queue.put(self._DONE)
+            normalizer.join()
+            writer.join()
+        return self.total_rows
+
+    def _normalize_loop(self):
+        # Errors are handled per item and _DONE is always forwarded: a stage that
+        # died would leave the bounded queues full and block run() forever
+        try:
+            while True:
+                item = self.fetch_queue.get()
+                if item is self._DONE:
+                    return
+                try:
+                    self._normalize(*item)
+                except Exception as e:
+                    self.fetcher._log_error(f"Normalize error for {self.endpoint_name} with params {item[0]}: {str(e)}")
+                    self.fetcher._record_failure(self.endpoint_name, item[0])
+        finally:
+            self.write_queue.put(self._DONE)
+
+    def _normalize(self, request_params, result):
+        if result is None:
+            self.fetcher._record_failure(self.endpoint_name, request_params)
+            return
+        data_list = self.fetcher._extract_rows(result)
+        if not isinstance(data_list, list):
+            self.fetcher._log_error(f"Invalid data format for {self.endpoint_name}: {str(result)[:100]}...")
+            self.fetcher._record_failure(self.endpoint_name, request_params)
+            return
+        constants = {"symbol": request_params["symbol"]} if "symbol" in request_params else None
+        rows = self.row_mapper.map_rows(data_list, constants)
+        self.write_queue.put((request_params, rows))
+
+    def _write_loop(self):
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.write_queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush()
+                deadline = None
+                continue
+            if item is self._DONE:
+                self._flush()
+                return
+            request_params, rows = item
+            self.buffer_rows.extend(rows)
+            self.pending_requests.append((request_params, len(rows)))
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_seconds
+            if len(self.buffer_rows) >= self.batch_rows:
+                self._flush()
+                deadline = None
+
+    def _flush(self):
+        """Write the buffered rows and checkpoint their requests. Never raises, so the writer keeps draining."""
+        rows, self.buffer_rows = self.buffer_rows, []
+        completed, self.pending_requests = self.pending_requests, []
+        if not completed:
+            return
+        written = 0
+        if rows:
+            try:
+                written = self.fetcher._write_rows(self.endpoint_name, self.columns, rows)
+            except Exception as e:
+                self.fetcher._log_error(f"Error writing batch of {len(rows)} rows to {self.table_name}: {str(e)}")
+                if self.fetcher.debug_capture is not None:
+                    self.fetcher.debug_capture.capture("mapped_rows", self.endpoint_name, rows, columns=self.columns, error=str(e))
+                for request_params, _ in completed:
+                    self.fetcher._record_failure(self.endpoint_name, request_params)
+                return
+            if self.fetcher.debug_capture is not None and self.fetcher.debug_capture.should_sample():
+                self.fetcher.debug_capture.capture("mapped_rows", self.endpoint_name, rows, columns=self.columns)
+        self.total_rows += written
+        print(f"Inserted {written} rows for {self.endpoint_name} from {len(completed)} requests")
+        for request_params, row_count in completed:
+            try:
+                self.fetcher._mark_complete(self.endpoint_name, request_params, row_count)
+            except Exception as e:
+                self.fetcher._log_error(f"Error checkpointing {self.endpoint_name} with params {request_params}: {str(e)}")
+                self.fetcher._record_failure(self.endpoint_name, request_params)
 
 class NSEDataFetcher:
-    def __init__(self, config_path, start_date='01-01-2000', end_date='01-03-2025', base_url="https://www.nseindia.com"):
+    def __init__(self, config_path, start_date='01-01-2000', end_date='01-03-2025', base_url="https://www.nseindia.com",
+                 max_workers=1, requests_per_second=None, write_method="copy", incremental=False,
+                 adaptive_windows=False, window_state_path=None, session_pool_size=None,
+                 referer_mode="per_request", response_cache_dir=None, cache_only=False, stream_batch_size=None,
+                 pipeline=False, write_batch_rows=5000, write_flush_seconds=2.0, pipeline_queue_size=64, proxy=None,
+                 job_queue_run_id=None, max_attempts=4, retry_base_delay=1.0, circuit_failure_threshold=5,
+                 circuit_reset_seconds=60, circuit_max_wait=None, metrics_path=None, trace=False,
+                 debug_dir=None, debug_sample_every=0, sinks=None, parquet_dir=None, state_dir=None):
+        # Per-endpoint counters and histograms, exported to `metrics_path` at the end of
+        # run() (.prom for Prometheus text, otherwise a JSON summary)
+        self.metrics = telemetry.metrics
+        self.metrics.trace = self.metrics.trace or trace
+        self.metrics_path = metrics_path
+        self.current_endpoint = None
+        # Requests that failed (fetch, decode or write) per endpoint, so callers such as
+        # ShardedRunner can retry them; None stands for a failure of the whole endpoint
+        self.failed_requests = {}
+        self.failed_lock = threading.Lock()
+        # Checkpoints of requests whose rows sit in a buffering sink (Parquet), per
+        # endpoint; they are only recorded once the sinks have flushed
+        self.deferred_checkpoints = {}
         try:
             # Load configuration files
             with open(os.path.join(config_path, "api.json"), "r") as f:
@@ -18,13 +192,54 @@ class NSEDataFetcher:
                 self.headers = json.load(f)
             with open(os.path.join(config_path, "schema.json"), "r") as f:
                 self.schema = json.load(f)
+            # Keys starting with "_" are endpoint options (e.g. "_natural_key"), not columns
+            self.schema_options = {}
+            self.row_mappers = {}
+            for endpoint_name, schema_map in self.schema.items():
+                self.schema_options[endpoint_name] = {key: schema_map.pop(key) for key in list(schema_map) if key.startswith("_")}
                 
             self.base_url = base_url
             self.domain = "nseindia.com"
+            # Optional egress proxy, e.g. so each sharded worker process leaves from its own IP
+            self.proxies = {"http": proxy, "https": proxy} if proxy else None
             self.start_date = start_date
             self.end_date = end_date
             self.request_count = 0
             self.requests_before_refresh = 20
+            self.write_method = write_method
+            self.session_lock = threading.Lock()
+            
+            # Concurrency settings: a token bucket replaces the per-request random sleep
+            # whenever a global request rate is configured
+            self.max_workers = max(1, int(max_workers))
+            self.rate_limiter = TokenBucket(requests_per_second) if requests_per_second else None
+            self.thread_state = threading.local()
+            
+            # Transient failures (429, 5xx, timeouts, rejected sessions) are retried with
+            # backoff; an endpoint that keeps failing is paused by its circuit breaker
+            self.retry_policy = RetryPolicy(max_attempts=max_attempts, base_delay=retry_base_delay,
+                                            failure_threshold=circuit_failure_threshold,
+                                            reset_seconds=circuit_reset_seconds,
+                                            max_circuit_wait=circuit_max_wait)
+            
+            # "per_request" visits the referer page before every API call, "per_session"
+            # only on the first call for each referer on a given session
+            if referer_mode not in ("per_request", "per_session"):
+                raise ValueError(f"referer_mode must be 'per_request' or 'per_session'. Got: {referer_mode}")
+            self.referer_mode = referer_mode
+            self.referer_lock = threading.Lock()
+            self.referer_costs = {}
+            self.referer_skips = 0
+            
+            # Local state kept between runs (learned window sizes) lives in `state_dir`,
+            # by default state/ next to this module rather than the working directory
+            self.state_dir = state_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "state")
+            
+            # Adaptive date windows: per-endpoint planners, with learned sizes kept between runs
+            if window_state_path is None:
+                window_state_path = os.path.join(self.state_dir, "window_sizes.json")
+            self.window_store = WindowSizeStore(window_state_path) if adaptive_windows else None
+            self.window_planners = {}
             
             # Initialize PostgreSQL connection
             psql_config = {
@@ -34,10 +249,63 @@ class NSEDataFetcher:
                 "user": "sparsh",
                 "password": "algobulls"
             }
-            self.psql_conn = PGConn(psql_config)
+            # In streaming mode workers write their own batches, so give each one a connection
+            self.stream_batch_size = stream_batch_size
+            
+            # Pipeline mode: fetch workers -> bounded queue -> normalize -> batching writer
+            if pipeline and stream_batch_size:
+                raise ValueError("pipeline and stream_batch_size are mutually exclusive")
+            self.pipeline = pipeline
+            self.write_batch_rows = write_batch_rows
+            self.write_flush_seconds = write_flush_seconds
+            self.pipeline_queue_size = pipeline_queue_size
+            pool_size = self.max_workers if stream_batch_size and self.max_workers > 1 else None
+            self.psql_conn = PGConn(psql_config, pool_size=pool_size, metrics=self.metrics)
+            self.natural_key_writer = NaturalKeyWriter(self.psql_conn)
+            
+            # Where mapped rows go: Postgres by default, plus a partitioned Parquet copy
+            # for analytics when parquet_dir is set. The first sink's count is reported.
+            if sinks is None:
+                sinks = [PostgresSink(self.psql_conn, self.natural_key_writer, self.schema_options)]
+                if parquet_dir:
+                    sinks.append(ParquetSink(parquet_dir, self.schema_options))
+            self.sinks = sinks
+            
+            # Checkpoint store so reruns only fetch windows that are not recorded yet
+            self.ingest_state = None
+            if incremental:
+                self.ingest_state = IngestStateStore(self.psql_conn)
+                self.ingest_state.ensure_table()
+            
+            # Persistent job queue: the plan of run `job_queue_run_id` is stored in
+            # nse.fetch_jobs and drained from there, so a restarted run resumes it
+            self.job_queue = None
+            if job_queue_run_id:
+                self.job_queue = JobQueue(self.psql_conn, job_queue_run_id)
+                self.job_queue.ensure_table()
             
-            # Get fresh session with cookies instead of loading from file
-            self.session = self.get_fresh_cookies()
+            # Raw response cache, so failed writes and reprocessing don't hit NSE again.
+            # In cache_only mode nothing is fetched from the network.
+            self.response_cache = ResponseCache(response_cache_dir) if response_cache_dir else None
+            self.cache_only = cache_only
+            if cache_only and self.response_cache is None:
+                raise ValueError("cache_only requires response_cache_dir")
+            
+            # Off by default: with debug_dir set, failed write batches are saved there for
+            # replay, plus one in `debug_sample_every` successful batches
+            self.debug_capture = DebugCapture(debug_dir, sample_every=debug_sample_every) if debug_dir else None
+            
+            # Get fresh session with cookies instead of loading from file. With a session
+            # pool, warm sessions are rotated and refreshed in the background instead of
+            # being rebuilt every `requests_before_refresh` requests.
+            self.session_pool = None
+            if cache_only:
+                self.session = requests.Session()
+            elif session_pool_size:
+                self.session_pool = SessionPool(self.get_fresh_cookies, size=session_pool_size)
+                self.session = self.session_pool.start()
+            else:
+                self.session = self.get_fresh_cookies()
             # Store current cookies for reference
             self.cookies = {cookie.name: cookie.value for cookie in self.session.cookies}
             
@@ -47,6 +315,7 @@ class NSEDataFetcher:
 
     def _log_error(self, error_message):
         """Log errors to errors.txt file"""
+        self.metrics.inc("nse_errors_total", endpoint=self.current_endpoint)
         try:
             with open("errors.txt", "a") as f:
                 timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -55,11 +324,14 @@ class NSEDataFetcher:
             print(f"Error writing to error log: {e}")
 
     def get_fresh_cookies(self, max_retries: int = 3) -> requests.Session:
+        self.metrics.inc("nse_cookie_refreshes_total")
         session = requests.Session()
+        if self.proxies:
+            session.proxies.update(self.proxies)
         # Use self.headers instead of hardcoded headers
         for attempt in range(max_retries):
             try:
-                main_page_url = "https://www.nseindia.com/"
+                main_page_url = f"{self.base_url}/"
                 response = session.get(main_page_url, headers=self.headers, timeout=15)
                 response.raise_for_status()
                 
@@ -67,7 +339,7 @@ class NSEDataFetcher:
                     time.sleep(2)
                     continue
                     
-                pit_page_url = "https://www.nseindia.com/companies-listing/corporate-filings-insider-trading"
+                pit_page_url = f"{self.base_url}/companies-listing/corporate-filings-insider-trading"
                 response = session.get(pit_page_url, headers=self.headers, timeout=15)
                 response.raise_for_status()
                 
@@ -84,14 +356,18 @@ class NSEDataFetcher:
 
     def _refresh_session_if_needed(self):
         """Refresh cookies if request count reaches threshold"""
-        self.request_count += 1
-        if self.request_count >= self.requests_before_refresh:
-            print("Refreshing cookies...")
-            self.session = self.get_fresh_cookies()
-            # Reset cookie counter
-            self.request_count = 0
-            # Update cookies dictionary with new values
-            self.cookies = {cookie.name: cookie.value for cookie in self.session.cookies}
+        if self.session_pool is not None:
+            return self.session_pool.acquire()
+        with self.session_lock:
+            self.request_count += 1
+            if self.request_count >= self.requests_before_refresh:
+                print("Refreshing cookies...")
+                self.session = self.get_fresh_cookies()
+                # Reset cookie counter
+                self.request_count = 0
+                # Update cookies dictionary with new values
+                self.cookies = {cookie.name: cookie.value for cookie in self.session.cookies}
+            return self.session
 
     def _get_date_ranges(self, start_date: str, end_date: str, freq_days: int):
         try:
@@ -121,37 +397,155 @@ class NSEDataFetcher:
             self._log_error(f"Error generating date ranges: {str(e)}")
             return []
     
-    def _make_request(self, endpoint, params, referer_url):
-        # Check if we need to refresh cookies
-        self._refresh_session_if_needed()
+    def _visit_referer(self, session, referer_url):
+        """Load the referer page, at most once per session in per_session mode"""
+        visited = None
+        if self.referer_mode == "per_session":
+            visited = getattr(session, "visited_referers", None)
+            if visited is None:
+                visited = session.visited_referers = set()
+            if referer_url in visited:
+                with self.referer_lock:
+                    self.referer_skips += 1
+                return
         
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        start_time = time.monotonic()
+        response = session.get(referer_url, headers=self.headers, timeout=10)
+        elapsed_ms = (time.monotonic() - start_time) * 1000
+        with self.referer_lock:
+            cost = self.referer_costs.setdefault(referer_url, [0, 0, 0.0])
+            cost[0] += 1
+            cost[1] += len(response.content)
+            cost[2] += elapsed_ms
+        if visited is not None and response.ok:
+            visited.add(referer_url)
+
+    def _report_referer_savings(self, endpoint_name, referer_url):
+        """Print the estimated traffic and time saved by skipped referer visits"""
+        with self.referer_lock:
+            skips, self.referer_skips = self.referer_skips, 0
+            visits, total_bytes, total_ms = self.referer_costs.get(referer_url, [0, 0, 0.0])
+        if self.referer_mode != "per_session" or not visits:
+            return
+        saved_kb = skips * total_bytes / visits / 1024
+        saved_ms = skips * total_ms / visits
+        print(f"{endpoint_name}: skipped {skips} referer visits, saved ~{saved_kb:.0f} KB and ~{saved_ms:.0f} ms")
+
+    def _rotate_session(self, session):
+        """Replace a session NSE rejected, unless another thread already did"""
+        if self.session_pool is not None:
+            self.session_pool.report_failure(session)
+            return
+        with self.session_lock:
+            if self.session is session:
+                print("Session rejected, refreshing cookies...")
+                self.session = self.get_fresh_cookies()
+                self.request_count = 0
+                self.cookies = {cookie.name: cookie.value for cookie in self.session.cookies}
+
+    def _cached_response(self, endpoint, params):
+        """Return the parsed cached response for a request, or None"""
+        if self.response_cache is None:
+            return None
+        body = self.response_cache.get(endpoint, params)
+        if body is None:
+            return None
+        try:
+            result = json.loads(body)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            self._log_error(f"Error decoding cached JSON: {str(e)} for endpoint {endpoint} with params {params}")
+            return None
+        # Entries cached before error payloads were excluded are treated as misses
+        if not isinstance(self._extract_rows(result), list):
+            return None
+        return result
+
+    def _api_url(self, endpoint, params):
         url_extension = endpoint + "?" + "&".join([f"{key}={value}" for key, value in params.items()])
-        url = self.base_url + "/api/" + url_extension
+        return self.base_url + "/api/" + url_extension
+
+    def _send_request(self, endpoint, url, referer_url, stream=False, retry_timeouts=True):
+        """Send an API request on a fresh-enough session and return the successful response.
+
+        Transient failures are retried through the retry policy, rotating the
+        session when NSE rejects it. Every attempt, and every referer visit,
+        takes its own token from the rate budget.
+        """
+        sessions = []
+        
+        def send():
+            # Check if we need to refresh cookies
+            session = self._refresh_session_if_needed()
+            sessions.append(session)
+            self._visit_referer(session, referer_url)
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            return session.get(url, headers=self.headers, timeout=60, stream=stream)
+        
+        def on_failure(kind, response):
+            self.metrics.inc("nse_retries_total", endpoint=self.current_endpoint, kind=kind)
+            if kind in SESSION_FAILURES:
+                self._rotate_session(sessions[-1])
         
+        with self.metrics.span("nse_request", endpoint=self.current_endpoint):
+            response = self.retry_policy.call(endpoint, send, on_failure, retry_timeouts=retry_timeouts)
+        response.raise_for_status()
+        return response
+
+    def _make_request(self, endpoint, params, referer_url, raise_timeouts=False, use_cache=True):
+        if use_cache:
+            cached = self._cached_response(endpoint, params)
+            if cached is not None:
+                return cached
+        if self.cache_only:
+            self._log_error(f"Cache miss in cache_only mode for endpoint {endpoint} with params {params}")
+            return None
+        
+        url = self._api_url(endpoint, params)
         try:
-            self.session.get(referer_url, headers=self.headers, timeout=10)
-            response = self.session.get(url, headers=self.headers, timeout=60)
-            response.raise_for_status()
+            # Timeouts are left to the window planner when it can split the window instead
+            response = self._send_request(endpoint, url, referer_url, retry_timeouts=not raise_timeouts)
+            self.thread_state.response_bytes = len(response.content)
+            self.metrics.inc("nse_bytes_downloaded_total", int(response.headers.get("Content-Length") or len(response.content)),
+                             endpoint=self.current_endpoint)
 
             if not response.content:
                 self._log_error(f"Empty response received for URL: {url}")
                 return None
 
-            if 'br' in response.headers.get('Content-Encoding', ''):
-                try:
-                    decompressed_content = brotli.decompress(response.content)
-                    json_text = decompressed_content.decode('utf-8')
-                    return json.loads(json_text)
-                except Exception as e:
-                    self._log_error(f"Error decompressing/decoding JSON: {str(e)} for URL: {url}")
-                    return None
-            else:
+            with self.metrics.span("nse_decode", endpoint=self.current_endpoint):
+                if 'br' in response.headers.get('Content-Encoding', ''):
+                    try:
+                        body = brotli.decompress(response.content)
+                    except brotli.error:
+                        # urllib3 already decodes brotli when the package is installed
+                        body = response.content
+                    except Exception as e:
+                        self._log_error(f"Error decompressing/decoding JSON: {str(e)} for URL: {url}")
+                        return None
+                else:
+                    body = response.content
+                
                 try:
-                    return response.json()
-                except json.JSONDecodeError as e:
+                    result = json.loads(body)
+                except (json.JSONDecodeError, UnicodeDecodeError) as e:
                     self._log_error(f"Error decoding JSON: {str(e)} for URL: {url}")
                     return None
+            self.metrics.inc("nse_bytes_decompressed_total", len(body), endpoint=self.current_endpoint)
+            self.metrics.observe("nse_response_bytes", len(body), buckets=telemetry.BYTES_BUCKETS, endpoint=self.current_endpoint)
+            
+            # Error payloads and a missing/non-list "data" are failures, never cached
+            if self.response_cache is not None and isinstance(self._extract_rows(result), list):
+                self.response_cache.put(endpoint, params, body)
+            return result
                 
+        except requests.exceptions.Timeout as e:
+            if raise_timeouts:
+                raise
+            self._log_error(f"Request error for URL {url}: {str(e)}")
+            return None
         except requests.exceptions.RequestException as e:
             self._log_error(f"Request error for URL {url}: {str(e)}")
             return None
@@ -160,170 +554,534 @@ class NSEDataFetcher:
             return None
 
     def _generate_param_combinations(self, list_params):
-        if not list_params:
-            return [{}]
+        """Lazily yield every combination of the list params, first key outermost"""
+        keys = list(list_params)
+        for values in product(*(list_params[key] for key in keys)):
+            yield dict(zip(keys, values))
+
+    @staticmethod
+    def _build_insert_sql(data_list, table_name, schema_map):
+        """Build a multi-row INSERT statement (legacy write path, kept for comparison)"""
+        columns = list(schema_map.keys())
         
-        result = []
-        key, values = next(iter(list_params.items()))
-        remaining = {k: v for k, v in list_params.items() if k != key}
-        sub_combinations = self._generate_param_combinations(remaining)
-
-        for value in values:
-            for sub_combo in sub_combinations:
-                result.append({**sub_combo, key: value})
+        def format_value(val):
+            if val is None or val == "":
+                return "NULL"
+            if isinstance(val, str):
+                # Escape single quotes by doubling them
+                safe_val = val.replace("'", "''")
+                return f"'{safe_val}'"
+            # If numeric or other type, convert directly
+            return str(val)
+        # Build VALUES part of the SQL statement
+        values_list = []
+        for item in data_list:
+            value_row = []
+            for col in columns:
+                api_key = schema_map[col]
+                value = item.get(api_key)
+                value_row.append(format_value(value))
+            values_list.append(f"({', '.join(value_row)})")
         
-        return result
+        if not values_list:
+            return None
+        
+        return f"""
+            INSERT INTO nse.{table_name.lower()} 
+            ({', '.join(columns)})
+            VALUES {', '.join(values_list)};
+            """
 
-    def _write_to_db(self, data_list, table_name, schema_map):
-        """Write data to PostgreSQL database using f-string query"""
+    def _row_mapper(self, endpoint_name, schema_map):
+        """Return the compiled RowMapper for an endpoint, building it on first use"""
+        mapper = self.row_mappers.get(endpoint_name)
+        if mapper is None:
+            column_types = self.schema_options.get(endpoint_name, {}).get("_types")
+            mapper = self.row_mappers.setdefault(endpoint_name, RowMapper(schema_map, column_types))
+        return mapper
+
+    def _write_to_db(self, data_list, table_name, schema_map, constants=None):
+        """Bulk load data into PostgreSQL with COPY FROM STDIN.
+
+        `constants` maps API keys to a value set on every row (e.g. the request's
+        symbol). Returns the number of rows written, or None if the write failed.
+        """
         try:
             if not data_list or not schema_map:
                 return 0
+            if constants:
+                for item in data_list:
+                    item.update(constants)
             
-            # Get column names from schema map
-            columns = list(schema_map.keys())
-            
-            with open("debug.json", "w") as file:
-                json.dump(data_list, file, indent=4)
-            
-            def format_value(val):
-                if val is None or val == "":
-                    return "NULL"
-                if isinstance(val, str):
-                    # Escape single quotes by doubling them
-                    safe_val = val.replace("'", "''")
-                    return f"'{safe_val}'"
-                # If numeric or other type, convert directly
-                return str(val)
-            # Build VALUES part of the SQL statement
-            values_list = []
-            for item in data_list:
-                value_row = []
-                for col in columns:
-                    api_key = schema_map[col]
-                    value = item.get(api_key)
-                    value_row.append(format_value(value))
-                
-                # print(value_row)
-                # time.sleep(2)
-                values_list.append(f"({', '.join(value_row)})")
-            
-            if not values_list:
-                return 0
+            sql = None
+            if self.write_method == "insert":
+                sql = self._build_insert_sql(data_list, table_name, schema_map)
+                if sql is None:
+                    return 0
+                self.psql_conn.execute(sql)
+                written = len(data_list)
+            else:
+                mapper = self._row_mapper(table_name, schema_map)
+                written = self._write_rows(table_name, mapper.columns, mapper.map_rows(data_list))
+            if self.debug_capture is not None and self.debug_capture.should_sample():
+                self.debug_capture.capture("api_rows", table_name, data_list, sql=sql)
+            return written
+        except Exception as e:
+            self._log_error(f"Error writing to database table {table_name}: {str(e)}")
+            if self.debug_capture is not None:
+                self.debug_capture.capture("api_rows", table_name, data_list, error=str(e))
+            return None
+
+    def _write_rows(self, endpoint_name, columns, rows):
+        """Write column-ordered rows to every sink and return the count from the first"""
+        # Inside a streamed request's transaction, sinks outside the database get
+        # the rows only once it commits (see _stream_request)
+        held_rows = getattr(self.thread_state, "held_rows", None)
+        if (len(self.sinks) > 1 or held_rows is not None) and not isinstance(rows, list):
+            rows = list(rows)
+        written = None
+        with self.metrics.span("nse_write", endpoint=endpoint_name):
+            for sink in self.sinks:
+                if held_rows is not None and getattr(sink, "psql_conn", None) is not self.psql_conn:
+                    held_rows.append((sink, endpoint_name, columns, rows))
+                    sink_written = len(rows)
+                else:
+                    sink_written = sink.write(endpoint_name, columns, rows)
+                if written is None:
+                    written = sink_written
+        self.metrics.inc("nse_rows_written_total", written, endpoint=endpoint_name)
+        return written
+
+    def _throttle(self):
+        """Random delay between requests when no rate budget is configured"""
+        # Add random delay to avoid rate limiting
+        time.sleep(random.uniform(0.5, 2.0))
+
+    def _build_request_plan(self, endpoint_name, endpoint_config, freq_days):
+        """Lazily expand an endpoint config into the request params to fetch"""
+        params = dict(endpoint_config.get("params", {}))
+        has_date_params = "from_date" in params and "to_date" in params
+        
+        from_date = to_date = None
+        if has_date_params:
+            from_date = params.pop("from_date", None) or self.start_date
+            to_date = params.pop("to_date", None) or self.end_date
+        
+        list_params = {}
+        for key, value in list(params.items()):
+            if isinstance(value, list):
+                list_params[key] = value
+                params.pop(key)
+        
+        planner = self.window_planners.get(endpoint_name)
+        for param_combo in self._generate_param_combinations(list_params):
+            base_params = {**params, **param_combo}
+            if not has_date_params:
+                if self.ingest_state is not None and self.ingest_state.is_complete(endpoint_name, base_params):
+                    continue
+                yield base_params
+                continue
             
-            # Build the complete SQL statement
-            sql = f"""
-            INSERT INTO nse.{table_name.lower()} 
-            ({', '.join(columns)})
-            VALUES {', '.join(values_list)};
-            """
+            if self.ingest_state is not None:
+                periods = self.ingest_state.missing_ranges(endpoint_name, base_params, from_date, to_date)
+            else:
+                periods = [(from_date, to_date)]
+            for period_from, period_to in periods:
+                if planner is not None:
+                    date_ranges = planner.window_ranges(period_from, period_to)
+                else:
+                    date_ranges = self._get_date_ranges(period_from, period_to, freq_days)
+                for date_range in date_ranges:
+                    yield {**base_params, **date_range}
+
+    def _queued_plan(self, endpoint_name, endpoint_config, plan):
+        """Drain the endpoint's jobs from the persistent queue, enqueueing the plan on first use.
+
+        Jobs are scoped to the config the plan was built from, so shards of an
+        endpoint each enqueue their own slice, and processes sharing a config
+        enqueue its plan only once.
+        """
+        self.job_queue.set_plan(endpoint_name, {"params": endpoint_config.get("params", {}),
+                                                "start_date": self.start_date, "end_date": self.end_date})
+        job_count = self.job_queue.enqueue_once(endpoint_name, plan)
+        if job_count is not None:
+            print(f"Queued {job_count} jobs for {endpoint_name}")
+        self.job_queue.requeue_stale(endpoint_name)
+        while True:
+            jobs = self.job_queue.claim(endpoint_name)
+            if not jobs:
+                return
+            self._report_job_progress(endpoint_name)
+            yield from jobs
+
+    def _report_job_progress(self, endpoint_name):
+        progress = self.job_queue.progress(endpoint_name)
+        if not progress:
+            return
+        line = (f"{endpoint_name} jobs: {progress['done']} done, {progress['pending']} pending, "
+                f"{progress['running']} running, {progress['failed']} failed")
+        if progress["jobs_per_second"]:
+            line += f" ({progress['jobs_per_second']:.1f} jobs/s, ETA {progress['eta_seconds'] / 60:.1f} min)"
+        print(line)
 
-            with open ("sql.txt", "w") as f:
-                f.write(sql)
+    def _mark_complete(self, endpoint_name, request_params, rows_inserted):
+        """Record a request whose rows were written in the checkpoint store and job queue.
+
+        With a buffering sink the rows are not durable yet, so the checkpoint
+        waits for _flush_sinks.
+        """
+        if any(getattr(sink, "buffers_rows", False) for sink in self.sinks):
+            with self.failed_lock:
+                self.deferred_checkpoints.setdefault(endpoint_name, []).append((request_params, rows_inserted))
+            return
+        self._checkpoint(endpoint_name, request_params, rows_inserted)
+
+    def _checkpoint(self, endpoint_name, request_params, rows_inserted):
+        if self.ingest_state is not None:
+            self.ingest_state.mark_complete(endpoint_name, request_params, rows_inserted)
+        if self.job_queue is not None:
+            self.job_queue.complete(endpoint_name, request_params, rows_inserted)
+
+    @staticmethod
+    def _extract_rows(result):
+        """Return the data rows of a payload, which may be a list or nested under the data key"""
+        return result.get("data", result) if isinstance(result, dict) else result
+
+    def _fetch_window(self, planner, endpoint, request_params, referer_url):
+        """Fetch a date window, splitting it in halves when the request times out"""
+        start_time = time.monotonic()
+        try:
+            result = self._make_request(endpoint, request_params, referer_url, raise_timeouts=True, use_cache=False)
+        except requests.exceptions.Timeout:
+            planner.observe_timeout()
+            halves = planner.split(request_params)
+            if halves is None:
+                self._log_error(f"Request timed out for single-day window {request_params}")
+                return None
+            print(f"Request timed out, splitting window {request_params['from_date']} - {request_params['to_date']}")
+            combined = []
+            for half in halves:
+                half_result = self._fetch_window(planner, endpoint, {**request_params, **half}, referer_url)
+                if half_result is None:
+                    return None
+                combined.extend(self._extract_rows(half_result) or [])
+            return combined
+        
+        if result is not None:
+            rows = self._extract_rows(result)
+            planner.observe(len(rows) if isinstance(rows, list) else 0,
+                            getattr(self.thread_state, "response_bytes", 0),
+                            time.monotonic() - start_time)
+        return result
+
+    def _fetch_request(self, endpoint_name, endpoint, request_params, referer_url):
+        """Fetch a single request from the plan; the rate budget is taken per attempt in _send_request"""
+        # Cache hits skip the rate budget entirely
+        cached = self._cached_response(endpoint, request_params)
+        if cached is not None:
+            return cached
+        if self.cache_only:
+            return self._make_request(endpoint, request_params, referer_url, use_cache=False)
+        
+        planner = self.window_planners.get(endpoint_name) if "from_date" in request_params else None
+        if planner is not None:
+            result = self._fetch_window(planner, endpoint, request_params, referer_url)
+        else:
+            result = self._make_request(endpoint, request_params, referer_url, use_cache=False)
+        if self.rate_limiter is None:
+            self._throttle()
+        return result
+
+    def _stream_request(self, endpoint_name, endpoint, request_params, referer_url, schema_map):
+        """Fetch a request and write its rows in batches of `stream_batch_size` as they are decoded.
+
+        The response is decompressed and parsed incrementally, so peak memory
+        follows the batch size rather than the response size. All batches of the
+        request are written in one transaction, so a request that fails part way
+        leaves no rows behind to be inserted again on retry; the transaction
+        holds a database connection while the response downloads. Returns the
+        rows inserted, or None if the request or one of the writes failed.
+        """
+        cache_entry = self.response_cache.open_entry(endpoint, request_params) if self.response_cache else None
+        if cache_entry is None and self.cache_only:
+            self._log_error(f"Cache miss in cache_only mode for endpoint {endpoint} with params {request_params}")
+            return None
+        
+        url = self._api_url(endpoint, request_params)
+        response = cache_writer = None
+        planner = self.window_planners.get(endpoint_name) if "from_date" in request_params else None
+        start_time = time.monotonic()
+        rows_inserted = 0
+        try:
+            if cache_entry is not None:
+                chunks = iter(lambda: cache_entry.read(65536), b"")
+            else:
+                response = self._send_request(endpoint, url, referer_url, stream=True)
+                raw_chunks = self._count_bytes(response.raw.stream(65536, decode_content=False))
+                chunks = iter_decoded_chunks(raw_chunks, response.headers.get("Content-Encoding", ""))
+                if self.response_cache is not None:
+                    cache_writer = self.response_cache.writer(endpoint, request_params)
+                    chunks = self._tee_chunks(chunks, cache_writer)
             
-            # Execute the SQL query
-            self.psql_conn.execute(sql)
+            constants = {"symbol": request_params["symbol"]} if "symbol" in request_params else None
+            items = JSONArrayStream(chunks)
+            item_iter = iter(items)
+            self.thread_state.held_rows = held_rows = []
+            with self.psql_conn.transaction():
+                while True:
+                    batch = list(islice(item_iter, self.stream_batch_size))
+                    if not batch:
+                        break
+                    written = self._write_to_db(batch, endpoint_name, schema_map, constants)
+                    if written is None:
+                        raise RuntimeError(f"Batch write failed after {rows_inserted} rows")
+                    rows_inserted += written
+                if not items.found:
+                    # An error payload or a missing/non-list "data" is a failed request, not an
+                    # empty window, so it is neither cached nor checkpointed as complete
+                    raise ValueError(f"Invalid data format for {endpoint_name} with params {request_params}")
+            self.thread_state.held_rows = None
+            for sink, held_endpoint, columns, rows in held_rows:
+                sink.write(held_endpoint, columns, rows)
             
-            return len(values_list)
+            if cache_writer is not None:
+                cache_writer.commit()
+                cache_writer = None
+            self.metrics.inc("nse_bytes_decompressed_total", items.bytes_read, endpoint=self.current_endpoint)
+            self.metrics.observe("nse_response_bytes", items.bytes_read, buckets=telemetry.BYTES_BUCKETS, endpoint=self.current_endpoint)
+            if planner is not None:
+                planner.observe(rows_inserted, items.bytes_read, time.monotonic() - start_time)
+            print(f"Inserted {rows_inserted} rows for {endpoint_name} with params {request_params}")
+            return rows_inserted
         except Exception as e:
-            self._log_error(f"Error writing to database table {table_name}: {str(e)}")
+            self._log_error(f"Streaming error for URL {url}: {str(e)}")
+            return None
+        finally:
+            self.thread_state.held_rows = None
+            if cache_writer is not None:
+                cache_writer.discard()
+            if cache_entry is not None:
+                cache_entry.close()
+            if response is not None:
+                response.close()
+                if self.rate_limiter is None:
+                    self._throttle()
+
+    def _count_bytes(self, chunks):
+        for chunk in chunks:
+            self.metrics.inc("nse_bytes_downloaded_total", len(chunk), endpoint=self.current_endpoint)
+            yield chunk
+
+    @staticmethod
+    def _tee_chunks(chunks, cache_writer):
+        for chunk in chunks:
+            cache_writer.write(chunk)
+            yield chunk
+
+    def _handle_streamed(self, rows_inserted, request_params, endpoint_name, schema_map):
+        """Record a streamed request that already wrote its own rows"""
+        if rows_inserted is None:
+            self._record_failure(endpoint_name, request_params)
+            return 0
+        self._mark_complete(endpoint_name, request_params, rows_inserted)
+        return rows_inserted
+
+    def _record_failure(self, endpoint_name, request_params):
+        with self.failed_lock:
+            self.failed_requests.setdefault(endpoint_name, []).append(request_params)
+
+    def pop_failed_requests(self, endpoint_name):
+        """Return and forget the requests of an endpoint that failed since the last call"""
+        with self.failed_lock:
+            return self.failed_requests.pop(endpoint_name, [])
+
+    def _handle_result(self, result, request_params, endpoint_name, schema_map):
+        """Write a fetched payload to the database and return the rows inserted"""
+        if result is None:
+            self._record_failure(endpoint_name, request_params)
             return 0
+        # Check if the result is directly a list or if it's nested
+        data_list = self._extract_rows(result)
+        if not isinstance(data_list, list):
+            self._log_error(f"Invalid data format for {endpoint_name}: {str(result)[:100]}...")
+            self._record_failure(endpoint_name, request_params)
+            return 0
+        rows_inserted = 0
+        if data_list:
+            constants = {"symbol": request_params["symbol"]} if "symbol" in request_params else None
+            rows_inserted = self._write_to_db(data_list, endpoint_name, schema_map, constants)
+            if rows_inserted is None:
+                self._record_failure(endpoint_name, request_params)
+                return 0
+            print(f"Inserted {rows_inserted} rows for {endpoint_name} with params {request_params}")
+        self._mark_complete(endpoint_name, request_params, rows_inserted)
+        return rows_inserted
 
-    def fetch_data(self, endpoint_name, endpoint_config, freq_days=7):
-        """Fetch data and write to database"""
+    def _run_plan(self, plan, fetch, handle, endpoint_name):
+        """Run the request plan, through a bounded worker pool when max_workers > 1.
+
+        `fetch(request_params)` runs on the workers; `handle(result, request_params)`
+        runs on the calling thread and returns the rows inserted.
+        """
+        if self.max_workers <= 1:
+            return sum(handle(fetch(request_params), request_params) for request_params in plan)
+        
+        total_rows_inserted = 0
+        max_in_flight = self.max_workers * 2
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+            plan_iter = iter(plan)
+            while True:
+                for request_params in plan_iter:
+                    future = executor.submit(fetch, request_params)
+                    pending[future] = request_params
+                    if len(pending) >= max_in_flight:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    request_params = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self._log_error(f"Worker error for {endpoint_name} with params {request_params}: {str(e)}")
+                        self._record_failure(endpoint_name, request_params)
+                        continue
+                    total_rows_inserted += handle(result, request_params)
+        return total_rows_inserted
+
+    def _execute_plan(self, plan, endpoint_name, endpoint, referer_url, schema_map):
+        """Fetch and write every request of the plan and return the rows inserted"""
+        if self.stream_batch_size:
+            fetch = lambda request_params: self._stream_request(endpoint_name, endpoint, request_params, referer_url, schema_map)
+            handle = lambda rows, request_params: self._handle_streamed(rows, request_params, endpoint_name, schema_map)
+        else:
+            fetch = lambda request_params: self._fetch_request(endpoint_name, endpoint, request_params, referer_url)
+            handle = lambda result, request_params: self._handle_result(result, request_params, endpoint_name, schema_map)
+        if self.pipeline:
+            pipeline = FetchPipeline(self, endpoint_name, schema_map, queue_size=self.pipeline_queue_size,
+                                     batch_rows=self.write_batch_rows, flush_seconds=self.write_flush_seconds)
+            return pipeline.run(plan, fetch)
+        return self._run_plan(plan, fetch, handle, endpoint_name)
+
+    def fetch_data(self, endpoint_name, endpoint_config, freq_days=7, compact_state=True):
+        """Fetch data and write to database.
+
+        Pass compact_state=False when other processes write checkpoints for the
+        same endpoint concurrently, and compact once they are all done.
+        """
         try:
             if endpoint_name not in self.schema:
                 self._log_error(f"Schema not found for endpoint: {endpoint_name}")
+                self._record_failure(endpoint_name, None)
                 return 0
             
             schema_map = self.schema[endpoint_name]
+            self.current_endpoint = endpoint_name
             endpoint = endpoint_config.get("endpoint", "")
             if not endpoint:
                 self._log_error(f"Endpoint URL not found for: {endpoint_name}")
+                self._record_failure(endpoint_name, None)
                 return 0
             
             referer_suffix = endpoint_config.get("referer", "corporate-filings-insider-trading")
             referer_url = f"{self.base_url}/companies-listing/{referer_suffix}"
             self.headers["Referer"] = referer_url
             
-            params = endpoint_config.get("params", {})
-            has_date_params = "from_date" in params and "to_date" in params
-            
-            date_ranges = []
-            if has_date_params:
-                from_date = params.get("from_date", self.start_date)
-                to_date = params.get("to_date", self.end_date)
-                if not from_date:
-                    from_date = self.start_date
-                if not to_date:
-                    to_date = self.end_date
-                
-                date_ranges = self._get_date_ranges(from_date, to_date, freq_days)
-                params_copy = params.copy()
-                params_copy.pop("from_date", None)
-                params_copy.pop("to_date", None)
-                params = params_copy
-            else:
-                date_ranges = [{}]
-            
-            list_params = {}
-            for key, value in list(params.items()):
-                if isinstance(value, list):
-                    list_params[key] = value
-                    params.pop(key)
-            
-            total_rows_inserted = 0
-            
-            if list_params:
-                param_combinations = self._generate_param_combinations(list_params)
-                
-                for param_combo in param_combinations:
-                    current_params = {**params, **param_combo}
-                    for date_range in date_ranges:
-                        request_params = {**current_params, **date_range}
-                        result = self._make_request(endpoint, request_params, referer_url)
-                        
-                        if result:
-                            # Check if the result is directly a list or if it's nested
-                            data_list = result.get("data", result)
-                            if "symbol" in request_params.keys():
-                                for entry in data_list:
-                                    entry["symbol"] = request_params["symbol"]
-                            if data_list and isinstance(data_list, list):
-
-                                rows_inserted = self._write_to_db(data_list, endpoint_name, schema_map)
-                                total_rows_inserted += rows_inserted
-                                print(f"Inserted {rows_inserted} rows for {endpoint_name} with params {request_params}")
-                            else:
-                                self._log_error(f"Invalid data format for {endpoint_name}: {str(result)[:100]}...")
-                        
-                        # Add random delay to avoid rate limiting
-                        random_time = random.uniform(0.5, 2.0)
-                        time.sleep(random_time)
-            else:
-                for date_range in date_ranges:
-                    request_params = {**params, **date_range}
-                    result = self._make_request(endpoint, request_params, referer_url)
-                    if result:
-                        # Check if the result is directly a list or if it's nested
-                        data_list = result
-                        
-                        if data_list and isinstance(data_list, list):
-                            rows_inserted = self._write_to_db(data_list, endpoint_name, schema_map)
-                            total_rows_inserted += rows_inserted
-                            print(f"Inserted {rows_inserted} rows for {endpoint_name} with params {request_params}")
-                        else:
-                            self._log_error(f"Invalid data format for {endpoint_name}: {str(result)[:100]}...")
-                    
-                    # Add random delay to avoid rate limiting
-                    random_time = random.uniform(0.5, 2.0)
-                    time.sleep(random_time)
-            
+            with self.referer_lock:
+                self.referer_skips = 0
+            if self.window_store is not None:
+                self.window_planners[endpoint_name] = AdaptiveWindowPlanner(
+                    initial_days=self.window_store.get(endpoint_name, freq_days))
+            plan = self._build_request_plan(endpoint_name, endpoint_config, freq_days)
+            if self.job_queue is not None:
+                plan = self._queued_plan(endpoint_name, endpoint_config, plan)
+            try:
+                with self.metrics.span("nse_endpoint", endpoint=endpoint_name):
+                    total_rows_inserted = self._execute_plan(plan, endpoint_name, endpoint, referer_url, schema_map)
+            finally:
+                # Rows already handed to the sinks are written out even if the plan failed
+                self._flush_sinks(endpoint_name)
+            if self.debug_capture is not None:
+                self.debug_capture.flush()
+            if self.job_queue is not None:
+                self.job_queue.release(endpoint_name)
+                self._report_job_progress(endpoint_name)
+            if self.ingest_state is not None and compact_state:
+                self.ingest_state.compact(endpoint_name)
+            if endpoint_name in self.window_planners:
+                self.window_store.save(endpoint_name, self.window_planners[endpoint_name].window_days)
+            self._report_referer_savings(endpoint_name, referer_url)
+            retry_report = self.retry_policy.report(endpoint)
+            if retry_report:
+                print(retry_report)
             return total_rows_inserted
         except Exception as e:
             self._log_error(f"Error fetching data for {endpoint_name}: {str(e)}")
+            self._record_failure(endpoint_name, None)
             return 0
 
+    def _flush_sinks(self, endpoint_name):
+        """Flush the endpoint's buffered rows, then record the checkpoints waiting on them"""
+        with self.failed_lock:
+            deferred = self.deferred_checkpoints.pop(endpoint_name, [])
+        try:
+            for sink in self.sinks:
+                sink.flush(endpoint_name)
+        except Exception as e:
+            # The buffered rows are lost, so their requests must be fetched again
+            self._log_error(f"Error flushing sinks for {endpoint_name}: {str(e)}")
+            for request_params, _ in deferred:
+                self._record_failure(endpoint_name, request_params)
+            return
+        for request_params, rows_inserted in deferred:
+            try:
+                self._checkpoint(endpoint_name, request_params, rows_inserted)
+            except Exception as e:
+                self._log_error(f"Error checkpointing {endpoint_name} with params {request_params}: {str(e)}")
+                self._record_failure(endpoint_name, request_params)
+
+    def replay_failed_batches(self):
+        """Retry the failed batches saved by the debug capture, removing each one that now writes"""
+        if self.debug_capture is None:
+            return 0
+        total_rows = 0
+        for path in self.debug_capture.failed_captures():
+            record = self.debug_capture.load(path)
+            table_name = record["table"]
+            try:
+                if record["kind"] == "mapped_rows":
+                    written = self._write_rows(table_name, record["columns"], record["rows"])
+                else:
+                    written = self._write_to_db(record["rows"], table_name, self.schema[table_name])
+            except Exception as e:
+                self._log_error(f"Error replaying {path}: {str(e)}")
+                continue
+            if written is None:
+                # _write_to_db saved the batch again with the new error
+                if record["kind"] == "api_rows":
+                    os.remove(path)
+                continue
+            total_rows += written
+            os.remove(path)
+            print(f"Replayed {path}: {written} rows inserted")
+        self.debug_capture.flush()
+        return total_rows
+
+    def close(self):
+        """Stop the session pool's refresher, close its sessions and flush and close the sinks"""
+        if self.session_pool is not None:
+            self.session_pool.close()
+            self.session_pool = None
+        for endpoint_name in list(self.deferred_checkpoints):
+            self._flush_sinks(endpoint_name)
+        for sink in getattr(self, "sinks", []):
+            try:
+                sink.close()
+            except Exception as e:
+                self._log_error(f"Error closing sink {type(sink).__name__}: {str(e)}")
+
     def run(self):
         """Run the data fetcher for all endpoints in the config"""
         try:
@@ -338,10 +1096,17 @@ class NSEDataFetcher:
                     self._log_error(f"Schema not found for {endpoint_name}, skipping...")
             
             print(f"Total rows inserted: {total_rows}")
+            if self.response_cache is not None:
+                print(f"Response cache: {self.response_cache.hits} hits, {self.response_cache.misses} misses")
+            if self.metrics_path:
+                self.metrics.export(self.metrics_path)
+                print(f"Metrics written to {self.metrics_path}")
             return total_rows
         except Exception as e:
             self._log_error(f"Error in run method: {str(e)}")
             return 0
+        finally:
+            self.close()
 
 if __name__ == "__main__":
     # Config path
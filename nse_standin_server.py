@@ -0,0 +1,186 @@
+import argparse
+import base64
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from response_cache import ResponseCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def _fake_jwt(ttl_seconds):
+    """Unsigned JWT shaped like NSE's nseappid cookie"""
+    def encode(part):
+        return base64.urlsafe_b64encode(json.dumps(part).encode("utf-8")).decode("ascii").rstrip("=")
+    now = int(time.time())
+    return f"{encode({'alg': 'HS256', 'typ': 'JWT'})}.{encode({'iss': 'api.nse', 'iat': now, 'exp': now + ttl_seconds})}.standin"
+
+class NSEStandInServer:
+    """Local HTTP stand-in for www.nseindia.com used for offline benchmarks and replays.
+
+    Serves the homepage and referer pages with the cookies NSEDataFetcher
+    expects, and answers /api/<endpoint> with recorded responses from a
+    ResponseCache directory when available, or synthetic rows built from
+    schema.json otherwise. Latency, error rate and content encoding are
+    configurable, and `malformed_rate` answers a fraction of calls with
+    `{"data": ["not-a-dict"]}` to exercise error handling.
+    """
+
+    def __init__(self, config_path="config", host="127.0.0.1", port=0, latency_ms=50, jitter_ms=20,
+                 error_rate=0.0, encoding="gzip", rows_per_request=50, recordings_dir=None, cookie_ttl=7200,
+                 malformed_rate=0.0):
+        if encoding not in ("identity", "gzip", "br"):
+            raise ValueError(f"encoding must be identity, gzip or br. Got: {encoding}")
+        if encoding == "br" and brotli is None:
+            raise ValueError("brotli is required for encoding='br'")
+        with open(os.path.join(config_path, "api.json"), "r") as f:
+            config_dict = json.load(f)
+        with open(os.path.join(config_path, "schema.json"), "r") as f:
+            schema = json.load(f)
+        # API endpoint path -> list of API keys to synthesise
+        self.endpoint_fields = {}
+        for endpoint_name, endpoint_config in config_dict.items():
+            fields = [api_key for column, api_key in schema.get(endpoint_name, {}).items() if not column.startswith("_")]
+            self.endpoint_fields[endpoint_config.get("endpoint", "")] = fields or ["symbol", "desc", "an_dt"]
+
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.encoding = encoding
+        self.rows_per_request = rows_per_request
+        self.cookie_ttl = cookie_ttl
+        self.recordings = ResponseCache(recordings_dir) if recordings_dir else None
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="nse-standin", daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def synthetic_payload(self, endpoint, params):
+        """Deterministic fake rows for an endpoint, seeded by the request params"""
+        seed = hashlib.sha256(f"{endpoint}?{sorted(params.items())}".encode("utf-8")).hexdigest()
+        rng = random.Random(seed)
+        base_date = datetime.datetime(2024, 1, 1)
+        rows = []
+        for i in range(self.rows_per_request):
+            row = {}
+            for field in self.endpoint_fields.get(endpoint, ["symbol", "desc", "an_dt"]):
+                lowered = field.lower()
+                if lowered == "symbol":
+                    row[field] = params.get("symbol", f"SYM{rng.randint(1, 2000)}")
+                elif "dt" in lowered or "date" in lowered:
+                    row[field] = (base_date + datetime.timedelta(minutes=rng.randint(0, 500000))).strftime("%d-%b-%Y %H:%M:%S")
+                elif "yr" in lowered or "year" in lowered:
+                    row[field] = str(rng.randint(2000, 2025))
+                elif "file" in lowered:
+                    row[field] = f"https://nsearchives.nseindia.com/corporate/{seed[:12]}_{i}.pdf"
+                else:
+                    row[field] = " ".join(rng.choice(["Board", "Meeting", "Outcome", "Results", "Intimation", "Ltd"]) for _ in range(6))
+            rows.append(row)
+        return {"data": rows}
+
+    def encode_body(self, body):
+        if self.encoding == "gzip":
+            return gzip.compress(body), "gzip"
+        if self.encoding == "br":
+            return brotli.compress(body), "br"
+        return body, None
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type, encoding=None, cookies=()):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if encoding:
+                    self.send_header("Content-Encoding", encoding)
+                for cookie in cookies:
+                    self.send_header("Set-Cookie", cookie)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with server.lock:
+                    server.request_count += 1
+                parsed = urllib.parse.urlparse(self.path)
+                if not parsed.path.startswith("/api/"):
+                    # Homepage and referer pages: HTML plus the session cookies
+                    cookies = [f"nsit=standin{random.randint(0, 10 ** 9)}; Path=/",
+                               f"nseappid={_fake_jwt(server.cookie_ttl)}; Path=/"]
+                    self._send(200, b"<html><body>NSE stand-in</body></html>", "text/html; charset=utf-8", cookies=cookies)
+                    return
+
+                delay = max(0.0, server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)) / 1000
+                time.sleep(delay)
+                if random.random() < server.error_rate:
+                    status = random.choice([403, 429, 503])
+                    self._send(status, b"<html><body>Access Denied</body></html>", "text/html; charset=utf-8")
+                    return
+
+                endpoint = parsed.path[len("/api/"):]
+                params = dict(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True))
+                body = server.recordings.get(endpoint, params) if server.recordings else None
+                if body is None and random.random() < server.malformed_rate:
+                    body = b'{"data": ["not-a-dict"]}'
+                if body is None:
+                    body = json.dumps(server.synthetic_payload(endpoint, params)).encode("utf-8")
+                encoded, encoding = server.encode_body(body)
+                self._send(200, encoded, "application/json; charset=utf-8", encoding=encoding)
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded or synthetic NSE API responses locally.")
+    parser.add_argument("--config", type=str, default="config", help="Config directory with api.json and schema.json (default: config)")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50, help="Mean API latency in milliseconds (default: 50)")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="Uniform latency jitter in milliseconds (default: 20)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of API calls answered with 403/429/503 (default: 0)")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of API calls answered with a malformed data list (default: 0)")
+    parser.add_argument("--encoding", choices=["identity", "gzip", "br"], default="gzip")
+    parser.add_argument("--rows", type=int, default=50, help="Synthetic rows per API response (default: 50)")
+    parser.add_argument("--recordings", type=str, help="ResponseCache directory to replay recorded responses from")
+    args = parser.parse_args()
+
+    server = NSEStandInServer(config_path=args.config, host=args.host, port=args.port, latency_ms=args.latency_ms,
+                              jitter_ms=args.jitter_ms, error_rate=args.error_rate, encoding=args.encoding,
+                              rows_per_request=args.rows, recordings_dir=args.recordings,
+                              malformed_rate=args.malformed_rate)
+    print(f"NSE stand-in listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
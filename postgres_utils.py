@@ -1,40 +1,208 @@
 import psycopg2
+import queue
 import threading
+from contextlib import contextmanager
+import telemetry
+
+def _copy_escape(value):
+    """Format a single value for PostgreSQL COPY text format"""
+    if value is None or value == "":
+        return "\\N"
+    if not isinstance(value, str):
+        value = str(value)
+    return (value.replace("\\", "\\\\")
+                 .replace("\t", "\\t")
+                 .replace("\n", "\\n")
+                 .replace("\r", "\\r"))
+
+def encode_copy_row(row):
+    """Encode one row (iterable of values) as a COPY text format line"""
+    return "\t".join([_copy_escape(value) for value in row]) + "\n"
+
+class CopyRowStream:
+    """File-like object that lazily encodes rows for COPY FROM STDIN.
+
+    psycopg2's copy_expert pulls data with read(size), so rows are encoded
+    on demand and never materialised as a single SQL string.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = b""
+        self.row_count = 0
+
+    def read(self, size=-1):
+        parts = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = encode_copy_row(row).encode("utf-8")
+            parts.append(line)
+            length += len(line)
+            self.row_count += 1
+        data = b"".join(parts)
+        if size < 0:
+            chunk, self.buffer = data, b""
+        else:
+            chunk, self.buffer = data[:size], data[size:]
+        return chunk
+
+    def readline(self, size=-1):
+        return self.read(size)
 
 class PGConn:
     _expected_keys = ["database", "host", "port", "user", "password"]
     
-    def __init__(self, psql_setup_details={}):
+    def __init__(self, psql_setup_details={}, pool_size=None, checkout_timeout=30, metrics=None):
+        """Connection wrapper around psycopg2.
+
+        By default every query goes through one shared connection and callers
+        queue on a lock for it. Pass `pool_size` to use a bounded pool instead:
+        each thread leases its own connection, and checkout blocks for up to
+        `checkout_timeout` seconds when all connections are busy.
+        """
         self.details = psql_setup_details
+        self.metrics = metrics or telemetry.metrics
         self.conn = None
-        self.executing = False
-        self.query = ""
         self.terminate_event = threading.Event()
+        self.pool_size = pool_size
+        self.checkout_timeout = checkout_timeout
+        self.conn_lock = threading.Lock()
+        self.pool = queue.LifoQueue()
+        self.pool_lock = threading.Lock()
+        self.pool_created = 0
+        self.leases = threading.local()
+        # Connections with a query in flight, used to cancel them on termination
+        self.active_lock = threading.Lock()
+        self.active_queries = {}
         if sorted(self.details.keys()) != sorted(self._expected_keys):
             raise ValueError(f"Expected keys: {self._expected_keys}. Got: {self.details.keys()}")
+        if pool_size is not None and pool_size < 1:
+            raise ValueError(f"pool_size must be at least 1. Got: {pool_size}")
+
+    @property
+    def query(self):
+        with self.active_lock:
+            return "\n".join(sql for _, sql in self.active_queries.values())
+
+    @property
+    def executing(self):
+        with self.active_lock:
+            return bool(self.active_queries)
+
+    def _connect(self):
+        conn = psycopg2.connect(dbname=self.details["database"],
+                                host=self.details["host"],
+                                port=self.details["port"],
+                                user=self.details["user"],
+                                password=self.details["password"])
+        conn.autocommit = True
+        return conn
         
     def connection(self):
         try:
             if self.conn is None:
-                conn = psycopg2.connect(dbname=self.details["database"],
-                                        host=self.details["host"],
-                                        port=self.details["port"],
-                                        user=self.details["user"],
-                                        password=self.details["password"])
-                self.conn = conn
-                self.conn.autocommit = True
+                self.conn = self._connect()
         except Exception as e:
             raise e
         finally:
             return self.conn
+
+    def _checkout(self):
+        if self.pool_size is None:
+            self.conn_lock.acquire()
+            conn = self.connection()
+            if conn is None:
+                self.conn_lock.release()
+                raise ConnectionError("Could not connect to the database")
+            return conn
+        
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self.pool_lock:
+            can_create = self.pool_created < self.pool_size
+            if can_create:
+                self.pool_created += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self.pool_lock:
+                    self.pool_created -= 1
+                raise
+        try:
+            return self.pool.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Timed out after {self.checkout_timeout}s waiting for a pooled connection") from None
+
+    def _checkin(self, conn):
+        if self.pool_size is None:
+            self.conn_lock.release()
+            return
+        if conn.closed:
+            with self.pool_lock:
+                self.pool_created -= 1
+            return
+        self.pool.put(conn)
+
+    @contextmanager
+    def lease(self):
+        """Lease a connection for the current thread.
+
+        Nested leases on the same thread reuse the connection already held.
+        """
+        held = getattr(self.leases, "conn", None)
+        if held is not None:
+            yield held
+            return
+        conn = self._checkout()
+        self.leases.conn = conn
+        try:
+            yield conn
+        finally:
+            self.leases.conn = None
+            self._checkin(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Run the block's queries on one leased connection as a single transaction.
+
+        Commits when the block succeeds; rolls back if it raises or one of its
+        statements failed (execute() logs errors rather than raising them).
+        """
+        with self.lease() as conn:
+            with conn.cursor() as curr:
+                curr.execute("begin")
+            try:
+                yield conn
+            except BaseException:
+                with conn.cursor() as curr:
+                    curr.execute("rollback")
+                raise
+            failed = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR
+            with conn.cursor() as curr:
+                curr.execute("rollback" if failed else "commit")
+            if failed:
+                raise RuntimeError("Transaction rolled back after a failed statement")
+
+    def _cancel_active(self):
+        with self.active_lock:
+            active = list(self.active_queries.values())
+        if not active and self.conn is not None:
+            active = [(self.conn, "")]
+        for conn, sql in active:
+            conn.cancel()
+            print("Query cancelled on the database.")
+            print(sql)
     
     def handle_termination(self, signal_received, frame):
         print("Termination signal received. Cleaning up...")
         try:
-            if self.conn is not None:
-                self.conn.cancel()
-                print("Query cancelled on the database.")
-                print(self.query)
+            self._cancel_active()
         except Exception as e:
             print(f"Failed to cancel query: {e}")
         finally:
@@ -44,57 +212,107 @@ class PGConn:
         print("Termination signal received. Cleaning up...")
         self.terminate_event.set()
         try:
-            if self.conn is not None:
-                self.conn.cancel()
-                print("Query cancelled on the database.")
-                print(self.query)
+            self._cancel_active()
         except Exception as e:
             print(f"Failed to cancel query: {e}")
         finally:
             exit(1)
         
-    def run_psql_query(self,sql,with_desc=False):
+    def run_psql_query(self, conn, sql, with_desc=False):
         try:
-            with self.connection().cursor() as curr:
+            with conn.cursor() as curr:
                 curr.execute(sql)
                 try:
                     if with_desc:
-                        self.result = (curr.fetchall(), curr.description)
-                    else:
-                        self.result = curr.fetchall()
+                        return (curr.fetchall(), curr.description)
+                    return curr.fetchall()
                 except:
-                    self.result = None
+                    return None
         except Exception as e:
+            self.metrics.inc("pg_errors_total", op=self._operation(sql))
             print(f"Error executing query: {sql}")
             print(e)
-            self.result = None
-    
-    def execute(self, sql, with_desc=False):
-        if self.executing:
-            print("Another query is already executing. Waiting for it to finish.")
-        while self.executing:
-            pass
-        self.executing = True
-        self.query = sql
-        self.result = []
+            return None
+
+    @staticmethod
+    def _operation(sql):
+        """Leading SQL keyword (select, copy, insert, ...) used to label query metrics"""
+        words = sql.split(None, 1)
+        return words[0].lower() if words else "unknown"
+
+    def _run_leased(self, query, target, *args):
+        """Run target(conn, *args) on a leased connection.
+
+        On the main thread the work runs in a helper thread so a
+        KeyboardInterrupt can cancel the query through cleanup().
+        """
+        outcome = {}
         
-        query_thread = threading.Thread(target=self.run_psql_query,args=(sql,with_desc))
-        query_thread.start()
-        try:
-            query_thread.join()
-        except KeyboardInterrupt:
-            self.cleanup() 
+        def runner(conn):
+            try:
+                outcome["result"] = target(conn, *args)
+            except Exception as e:
+                outcome["error"] = e
+        
+        operation = self._operation(query)
+        with self.metrics.span("pg_query", op=operation), self.lease() as conn:
+            with self.active_lock:
+                self.active_queries[id(conn)] = (conn, query)
+            try:
+                if threading.current_thread() is threading.main_thread():
+                    query_thread = threading.Thread(target=runner, args=(conn,))
+                    query_thread.start()
+                    try:
+                        query_thread.join()
+                    except KeyboardInterrupt:
+                        self.cleanup()
+                else:
+                    runner(conn)
+            finally:
+                with self.active_lock:
+                    self.active_queries.pop(id(conn), None)
         
-        self.executing = False
-        self.query = ""
-        return self.result
+        if "error" in outcome:
+            self.metrics.inc("pg_errors_total", op=operation)
+            raise outcome["error"]
+        return outcome.get("result")
 
-    def __del__(self):
-        print("Destructor called for", self.conn)
+    def execute(self, sql, with_desc=False):
+        return self._run_leased(sql, self.run_psql_query, sql, with_desc)
+
+    def run_copy(self, conn, copy_sql, stream):
+        with conn.cursor() as curr:
+            curr.copy_expert(copy_sql, stream)
+
+    def copy_rows(self, table_name, columns, rows):
+        """Bulk load rows into table_name with COPY FROM STDIN.
+
+        `rows` is any iterable of value sequences ordered like `columns`; it is
+        consumed lazily. Returns the number of rows sent. Raises on failure.
+        """
+        copy_sql = f"COPY {table_name} ({', '.join(columns)}) FROM STDIN"
+        stream = CopyRowStream(rows)
+        self._run_leased(copy_sql, self.run_copy, copy_sql, stream)
+        return stream.row_count
+
+    def close(self):
+        """Close the shared connection and every idle pooled connection"""
+        while True:
+            try:
+                conn = self.pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self.pool_lock:
+                self.pool_created -= 1
         if self.conn is not None:
             self.conn.close()
         self.conn = None
 
+    def __del__(self):
+        print("Destructor called for", self.conn)
+        self.close()
+
 
 if __name__ == "__main__":
     pgconn = PGConn({
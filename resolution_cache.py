@@ -0,0 +1,104 @@
+import hashlib
+
+class ResolutionCache:
+    """Persistent memo of company-name resolutions, backed by a table.
+
+    Maps a normalized extracted name to the (company_name, symbol, score) the
+    matcher gave it, including misses (company_name None), so a name seen in
+    an earlier run skips fuzzy matching. Every entry carries the fingerprint of
+    the nse.metadata names and matcher settings it was computed with. Entries
+    with a different fingerprint are dropped on load, so a metadata refresh
+    invalidates the cache.
+    """
+
+    def __init__(self, psql_conn, fingerprint, table_name="trendlyne.company_name_resolutions"):
+        self.psql_conn = psql_conn
+        self.fingerprint = fingerprint
+        self.table_name = table_name
+        self.entries = {}
+        self.pending = {}
+
+    @staticmethod
+    def metadata_fingerprint(name_to_symbol, *settings):
+        """md5 of the (company_name, symbol) pairs plus any matcher settings"""
+        digest = hashlib.md5()
+        for name, symbol in sorted((str(name), str(symbol)) for name, symbol in name_to_symbol.items()):
+            digest.update(f"{name}\t{symbol}\n".encode("utf-8"))
+        for setting in settings:
+            digest.update(f"{setting}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def __getstate__(self):
+        # Worker processes only read the entries
+        state = self.__dict__.copy()
+        state["psql_conn"] = None
+        return state
+
+    def __len__(self):
+        return len(self.entries)
+
+    def ensure_table(self):
+        sql = f"""
+            create table if not exists {self.table_name} (
+                name_key text primary key,
+                company_name text,
+                company_symbol varchar(255),
+                score double precision,
+                metadata_fingerprint varchar(32) not null,
+                resolved_at timestamp default now()
+            );
+            """
+        self.psql_conn.execute(sql)
+
+    def load(self):
+        """Drop entries from other metadata versions and load the rest into memory"""
+        self.psql_conn.execute(f"delete from {self.table_name} where metadata_fingerprint <> '{self.fingerprint}';")
+        sql = f"""
+            select name_key, company_name, company_symbol, score
+            from {self.table_name}
+            where metadata_fingerprint = '{self.fingerprint}';
+            """
+        result = self.psql_conn.execute(sql) or []
+        self.entries = {row[0]: (row[1], row[2], row[3]) for row in result}
+        return len(self.entries)
+
+    def get(self, name_key):
+        return self.entries.get(name_key)
+
+    def update(self, resolutions):
+        """Add name_key -> (company_name, symbol, score) resolutions, to be written by save()"""
+        for name_key, resolution in resolutions.items():
+            if name_key not in self.entries:
+                self.pending[name_key] = resolution
+            self.entries[name_key] = resolution
+
+    def save(self):
+        """Write the new resolutions with COPY into a staging table and one upsert. Returns the rows written."""
+        if not self.pending:
+            return 0
+        rows = [(name_key, company_name, symbol, score, self.fingerprint)
+                for name_key, (company_name, symbol, score) in self.pending.items()]
+        staging_name = "stage_company_name_resolutions"
+        columns = ["name_key", "company_name", "company_symbol", "score", "metadata_fingerprint"]
+        # The staging table is a temp table, so every step must use the same connection
+        with self.psql_conn.lease():
+            self.psql_conn.execute(f"create temp table if not exists {staging_name} (like {self.table_name} including defaults);")
+            self.psql_conn.execute(f"truncate {staging_name};")
+            self.psql_conn.copy_rows(staging_name, columns, rows)
+            result = self.psql_conn.execute(f"""
+                with upserted as (
+                    insert into {self.table_name} ({', '.join(columns)})
+                    select {', '.join(columns)} from {staging_name}
+                    on conflict (name_key) do update set
+                        company_name = excluded.company_name,
+                        company_symbol = excluded.company_symbol,
+                        score = excluded.score,
+                        metadata_fingerprint = excluded.metadata_fingerprint,
+                        resolved_at = now()
+                    returning 1
+                )
+                select count(*) from upserted;""")
+        if not result:
+            raise RuntimeError(f"Upsert from {staging_name} into {self.table_name} failed")
+        self.pending = {}
+        return result[0][0]
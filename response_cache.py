@@ -0,0 +1,153 @@
+import datetime
+import gzip
+import hashlib
+import os
+import threading
+import time
+import urllib.parse
+
+class ResponseCache:
+    """Content-addressed on-disk cache of raw NSE API responses.
+
+    Entries are gzip-compressed response bodies stored under a sha256 of the
+    endpoint and its sorted params. A file's mtime is its write time (used
+    for TTLs) and its atime is its last read (used for LRU eviction once the
+    cache grows past `max_bytes`).
+    """
+
+    def __init__(self, cache_dir="response_cache", max_bytes=2 * 1024 ** 3, default_ttl=24 * 3600,
+                 ttl_by_endpoint=None, keep_closed_windows=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttl_by_endpoint = ttl_by_endpoint or {}
+        # Date windows that ended before today won't change, so they never expire
+        self.keep_closed_windows = keep_closed_windows
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cache_key(endpoint, params):
+        query = urllib.parse.urlencode(sorted((str(k), str(v)) for k, v in params.items()))
+        return hashlib.sha256(f"{endpoint}?{query}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.gz")
+
+    def _entries(self):
+        """Yield (path, size, last_access) for every cached entry"""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".gz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_atime
+
+    def ttl_for(self, endpoint, params):
+        """TTL in seconds for an entry, or None if it never expires"""
+        to_date = params.get("to_date")
+        if self.keep_closed_windows and to_date:
+            try:
+                if datetime.datetime.strptime(to_date, "%d-%m-%Y").date() < datetime.date.today():
+                    return None
+            except ValueError:
+                pass
+        return self.ttl_by_endpoint.get(endpoint, self.default_ttl)
+
+    def open_entry(self, endpoint, params):
+        """Return a readable file for a fresh cached body, or None on a miss or an expired entry"""
+        path = self._path(self.cache_key(endpoint, params))
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        ttl = self.ttl_for(endpoint, params)
+        now = time.time()
+        if ttl is not None and now - stat.st_mtime > ttl:
+            self.misses += 1
+            return None
+        # Record the read for LRU eviction without touching the write time
+        os.utime(path, (now, stat.st_mtime))
+        self.hits += 1
+        return gzip.open(path, "rb")
+
+    def get(self, endpoint, params):
+        """Return the cached raw body for a request, or None on a miss or an expired entry"""
+        entry = self.open_entry(endpoint, params)
+        if entry is None:
+            return None
+        try:
+            with entry:
+                return entry.read()
+        except (OSError, EOFError):
+            self.hits -= 1
+            self.misses += 1
+            return None
+
+    def writer(self, endpoint, params):
+        """Return a CacheWriter that streams a body into the cache"""
+        return CacheWriter(self, self._path(self.cache_key(endpoint, params)))
+
+    def put(self, endpoint, params, body):
+        """Store a raw response body"""
+        writer = self.writer(endpoint, params)
+        writer.write(body)
+        writer.commit()
+
+    def _commit(self, tmp_path, path):
+        size = os.path.getsize(tmp_path)
+        with self.lock:
+            try:
+                self.total_bytes -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self.total_bytes += size
+            over_limit = self.total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self, target_ratio=0.9):
+        """Delete least recently read entries until the cache is under target_ratio * max_bytes"""
+        with self.lock:
+            target = self.max_bytes * target_ratio
+            for path, size, _ in sorted(self._entries(), key=lambda entry: entry[2]):
+                if self.total_bytes <= target:
+                    break
+                try:
+                    os.remove(path)
+                    self.total_bytes -= size
+                except FileNotFoundError:
+                    pass
+
+class CacheWriter:
+    """Writes a body to a temporary file and moves it into the cache on commit"""
+
+    def __init__(self, cache, path):
+        self.cache = cache
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        self.file = gzip.open(self.tmp_path, "wb", compresslevel=6)
+
+    def write(self, data):
+        self.file.write(data)
+
+    def commit(self):
+        self.file.close()
+        self.cache._commit(self.tmp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,294 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+import requests
+
+# Failure kinds; None means the response is usable
+RATE_LIMITED = "rate_limited"
+AUTH = "auth"
+CAPTCHA = "captcha"
+SERVER = "server"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+
+# Failures worth another attempt; other 4xx responses will not change on retry
+RETRYABLE = (RATE_LIMITED, AUTH, CAPTCHA, SERVER, TIMEOUT, CONNECTION)
+# Failures rejecting the session rather than the request, fixed by a new session
+SESSION_FAILURES = (AUTH, CAPTCHA)
+
+def classify_response(response):
+    """Failure kind of an HTTP response, or None if it can be used"""
+    if response.status_code == 429:
+        return RATE_LIMITED
+    if response.status_code in (401, 403):
+        return AUTH
+    if response.status_code >= 500:
+        return SERVER
+    if response.status_code >= 400:
+        return "http_error"
+    # NSE answers blocked sessions with an HTML challenge page instead of JSON
+    if "text/html" in response.headers.get("Content-Type", ""):
+        return CAPTCHA
+    return None
+
+def classify_exception(error):
+    if isinstance(error, requests.exceptions.Timeout):
+        return TIMEOUT
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return CONNECTION
+    return None
+
+class RetriesExhaustedError(requests.exceptions.RequestException):
+    """The last failure of a request that ran out of attempts"""
+
+    def __init__(self, kind, attempts, message):
+        super().__init__(f"{kind} after {attempts} attempts: {message}")
+        self.kind = kind
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without sending the request when an endpoint's circuit stays open past the wait limit"""
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and holds calls back for
+    `reset_seconds`, then lets a single trial call through (half-open)."""
+
+    def __init__(self, failure_threshold=5, reset_seconds=60):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.open_count = 0
+        self.lock = threading.Lock()
+
+    def wait_time(self):
+        """0 if a call may go through now (taking the half-open trial if due), else seconds to wait"""
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self.trial_in_flight:
+                # The trial decides whether the circuit closes; poll for its outcome
+                return min(1.0, self.reset_seconds / 10) or 0.01
+            self.trial_in_flight = True
+            return 0
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release(self):
+        """End a call that says nothing about the endpoint's health"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    self.open_count += 1
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+class RequestStats:
+    """Attempt, retry and latency counters for one endpoint"""
+
+    def __init__(self, latency_window=1000):
+        self.requests = 0
+        self.attempts = 0
+        self.failures = 0
+        self.retries = {}
+        self.latencies_ms = deque(maxlen=latency_window)
+
+    def percentile(self, fraction):
+        if not self.latencies_ms:
+            return 0.0
+        ordered = sorted(self.latencies_ms)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class RetryPolicy:
+    """Shared retry layer: exponential backoff with full jitter, failure
+    classification, per-endpoint circuit breakers and request stats.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=60.0, failure_threshold=5, reset_seconds=60,
+                 max_circuit_wait=None):
+        self.max_attempts = max(1, max_attempts)
+        # How long a call waits for an open circuit to close before failing
+        self.max_circuit_wait = 5 * reset_seconds if max_circuit_wait is None else max_circuit_wait
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.breakers = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def _breaker(self, key):
+        with self.lock:
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+                self.stats[key] = RequestStats()
+            return self.breakers[key], self.stats[key]
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retry number `attempt` (0-based)"""
+        if retry_after:
+            try:
+                return min(self.max_delay, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _attempt(self, send_error, response, kind, elapsed_ms, breaker, stats, attempt, retry_timeouts):
+        """Record one attempt and decide what happens next: "done", "retry" or "fail" """
+        with self.lock:
+            stats.attempts += 1
+            stats.latencies_ms.append(elapsed_ms)
+        if kind is None and send_error is None:
+            breaker.record_success()
+            return "done"
+        # Session rejections are handled by rotating the session and other 4xx
+        # responses are specific to the request, so neither counts against the endpoint
+        if kind in SESSION_FAILURES or kind not in RETRYABLE:
+            breaker.release()
+        else:
+            breaker.record_failure()
+        last_attempt = attempt == self.max_attempts - 1
+        if kind not in RETRYABLE or (kind == TIMEOUT and not retry_timeouts) or last_attempt:
+            with self.lock:
+                stats.failures += 1
+            # A request still rejected after fresh sessions points at a block on the endpoint
+            if kind in SESSION_FAILURES:
+                breaker.record_failure()
+            return "fail"
+        with self.lock:
+            stats.retries[kind] = stats.retries.get(kind, 0) + 1
+        return "retry"
+
+    def _circuit_wait(self, key, breaker, deadline):
+        """Seconds to sleep before asking the breaker again, 0 to go ahead; raises past the deadline"""
+        wait_time = breaker.wait_time()
+        if wait_time and time.monotonic() + wait_time > deadline:
+            raise CircuitOpenError(f"Circuit open for {key}")
+        return wait_time
+
+    @staticmethod
+    def _failure(kind, attempts, response, error):
+        """The exception to raise for a request that failed for good, or None to return the response"""
+        if error is not None:
+            if kind is None or kind == TIMEOUT:
+                return error
+            failure = RetriesExhaustedError(kind, attempts, str(error))
+            failure.__cause__ = error
+            return failure
+        if kind in RETRYABLE:
+            return RetriesExhaustedError(kind, attempts, f"HTTP {response.status_code} for {response.url}")
+        return None
+
+    def call(self, key, send, on_failure=None, retry_timeouts=True):
+        """Call `send()` until it returns a usable response, retrying transient failures.
+
+        `on_failure(kind, response)` runs before each retry, e.g. to rotate the
+        session on auth failures. While the breaker for `key` is open the call
+        waits for it to half-open, and raises CircuitOpenError only if that
+        takes longer than `max_circuit_wait`. Raises RetriesExhaustedError (or the original exception for
+        non-retryable errors) once attempts run out.
+        """
+        breaker, stats = self._breaker(key)
+        with self.lock:
+            stats.requests += 1
+        deadline = time.monotonic() + self.max_circuit_wait
+        for attempt in range(self.max_attempts):
+            while True:
+                wait_time = self._circuit_wait(key, breaker, deadline)
+                if not wait_time:
+                    break
+                time.sleep(wait_time)
+            response = error = None
+            start_time = time.monotonic()
+            try:
+                response = send()
+                kind = classify_response(response)
+            except requests.exceptions.RequestException as e:
+                error = e
+                kind = classify_exception(e)
+            elapsed_ms = (time.monotonic() - start_time) * 1000
+
+            outcome = self._attempt(error, response, kind, elapsed_ms, breaker, stats, attempt, retry_timeouts)
+            if outcome == "done":
+                return response
+            if outcome == "fail":
+                failure = self._failure(kind, attempt + 1, response, error)
+                if failure is None:
+                    return response
+                if response is not None:
+                    response.close()
+                raise failure
+
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            if on_failure is not None:
+                on_failure(kind, response)
+            if response is not None:
+                response.close()
+            time.sleep(self.backoff(attempt, retry_after))
+
+    async def call_async(self, key, send, on_failure=None, retry_timeouts=True):
+        """Coroutine version of `call` for async clients.
+
+        `send` and `on_failure` are coroutine functions; `send` must raise
+        requests' Timeout/ConnectionError for transport failures so they are
+        classified the same way.
+        """
+        breaker, stats = self._breaker(key)
+        with self.lock:
+            stats.requests += 1
+        deadline = time.monotonic() + self.max_circuit_wait
+        for attempt in range(self.max_attempts):
+            while True:
+                wait_time = self._circuit_wait(key, breaker, deadline)
+                if not wait_time:
+                    break
+                await asyncio.sleep(wait_time)
+            response = error = None
+            start_time = time.monotonic()
+            try:
+                response = await send()
+                kind = classify_response(response)
+            except requests.exceptions.RequestException as e:
+                error = e
+                kind = classify_exception(e)
+            elapsed_ms = (time.monotonic() - start_time) * 1000
+
+            outcome = self._attempt(error, response, kind, elapsed_ms, breaker, stats, attempt, retry_timeouts)
+            if outcome == "done":
+                return response
+            if outcome == "fail":
+                failure = self._failure(kind, attempt + 1, response, error)
+                if failure is None:
+                    return response
+                raise failure
+
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            if on_failure is not None:
+                await on_failure(kind, response)
+            await asyncio.sleep(self.backoff(attempt, retry_after))
+
+    def report(self, key):
+        """One-line summary of the retry and latency stats for `key`"""
+        with self.lock:
+            stats = self.stats.get(key)
+            breaker = self.breakers.get(key)
+            if stats is None or not stats.requests:
+                return None
+            retries = ", ".join(f"{kind}: {count}" for kind, count in sorted(stats.retries.items())) or "none"
+            return (f"{key}: {stats.requests} requests, {stats.attempts} attempts, {stats.failures} failed, "
+                    f"retries ({retries}), circuit opened {breaker.open_count}x, "
+                    f"latency p50 {stats.percentile(0.5):.0f} ms / p95 {stats.percentile(0.95):.0f} ms")
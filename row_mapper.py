@@ -0,0 +1,95 @@
+from operator import itemgetter
+
+_MONTHS = {
+    "Jan": "01", "Feb": "02", "Mar": "03", "Apr": "04", "May": "05", "Jun": "06",
+    "Jul": "07", "Aug": "08", "Sep": "09", "Oct": "10", "Nov": "11", "Dec": "12"
+}
+_EMPTY_VALUES = ("", "-", "NA", "N/A", "Nil")
+
+def normalize_timestamp(value):
+    """Rewrite NSE's "01-Jan-2024 10:30[:15]" dates as ISO text by slicing instead of strptime.
+
+    Anything not in that shape is passed through for Postgres to parse.
+    """
+    if value is None or value in _EMPTY_VALUES:
+        return None
+    if not isinstance(value, str):
+        return value
+    if len(value) >= 11 and value[2] == "-" and value[6] == "-":
+        month = _MONTHS.get(value[3:6].title())
+        if month is not None:
+            rest = value[11:].strip()
+            date = f"{value[7:11]}-{month}-{value[0:2]}"
+            return f"{date} {rest}" if rest else date
+    return value
+
+def normalize_number(value):
+    """Strip thousands separators from numeric strings and map NSE's placeholders to NULL"""
+    if value is None or not isinstance(value, str):
+        return value
+    value = value.replace(",", "").strip()
+    return None if value in _EMPTY_VALUES else value
+
+_CONVERTERS = {
+    "timestamp": normalize_timestamp,
+    "date": normalize_timestamp,
+    "int": normalize_number,
+    "numeric": normalize_number
+}
+
+class RowMapper:
+    """Row mapper compiled once per endpoint from its schema.json column map.
+
+    Values are pulled out of each API row with a single itemgetter call, and
+    typed columns (declared under "_types" in schema.json) are converted a
+    whole column at a time, with repeated values converted only once.
+    """
+
+    def __init__(self, schema_map, column_types=None):
+        self.columns = list(schema_map.keys())
+        self.api_keys = [schema_map[col] for col in self.columns]
+        self.getter = itemgetter(*self.api_keys) if len(self.api_keys) > 1 else (lambda row: (row[self.api_keys[0]],))
+        column_types = column_types or {}
+        unknown = set(column_types.values()) - set(_CONVERTERS) - {"text"}
+        if unknown:
+            raise ValueError(f"Unknown column types: {sorted(unknown)}. Expected one of {sorted(_CONVERTERS)} or text")
+        self.converters = [(i, _CONVERTERS[column_types[col]]) for i, col in enumerate(self.columns)
+                           if column_types.get(col, "text") != "text"]
+
+    def _extract(self, data_list):
+        try:
+            return list(map(self.getter, data_list))
+        except (KeyError, TypeError):
+            # Some rows are missing keys; fall back to dict.get for this batch
+            return [tuple(row.get(api_key) for api_key in self.api_keys) for row in data_list]
+
+    def map_rows(self, data_list, constants=None):
+        """Map API rows to tuples ordered like `columns`.
+
+        `constants` maps API keys to a value used for every row, e.g. the
+        symbol of a per-symbol request; it is written into the row dicts.
+        """
+        if not data_list:
+            return []
+        if constants:
+            for row in data_list:
+                row.update(constants)
+        rows = self._extract(data_list)
+        if not self.converters:
+            return rows
+        
+        columns = list(zip(*rows))
+        for i, converter in self.converters:
+            column = columns[i]
+            try:
+                unique = set(column)
+            except TypeError:
+                columns[i] = list(map(converter, column))
+                continue
+            if len(unique) * 2 < len(column):
+                # Mostly repeated values: convert each distinct value once
+                lookup = {value: converter(value) for value in unique}
+                columns[i] = list(map(lookup.__getitem__, column))
+            else:
+                columns[i] = list(map(converter, column))
+        return list(zip(*columns))
@@ -0,0 +1,145 @@
+import base64
+import itertools
+import json
+import threading
+import time
+
+def jwt_expiry(token):
+    """Return the `exp` claim of a JWT as a unix timestamp, or None if it can't be read"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp is not None else None
+    except Exception:
+        return None
+
+class PooledSession:
+    """A warm session plus the metadata the pool needs to rotate it"""
+
+    def __init__(self, session, fallback_ttl):
+        self.session = session
+        self.created_at = time.time()
+        cookies = {cookie.name: cookie.value for cookie in session.cookies}
+        self.expires_at = jwt_expiry(cookies.get("nseappid", "")) or self.created_at + fallback_ttl
+        self.failed = False
+        self.refreshing = False
+
+    def needs_refresh(self, margin):
+        return self.failed or time.time() >= self.expires_at - margin
+
+    def usable(self):
+        """Not rejected and its JWT not yet expired, even if a refresh is still pending"""
+        return not self.failed and time.time() < self.expires_at
+
+class SessionPool:
+    """Keeps N warm NSE sessions and refreshes them in the background.
+
+    Sessions are replaced `refresh_margin` seconds before their nseappid
+    JWT expires, or as soon as a caller reports an auth failure, so fetch
+    workers only ever pick up a session that already has its cookies.
+    """
+
+    def __init__(self, session_factory, size=3, refresh_margin=300, fallback_ttl=1800,
+                 check_interval=5, acquire_timeout=60):
+        self.session_factory = session_factory
+        self.size = max(1, size)
+        self.refresh_margin = refresh_margin
+        self.fallback_ttl = fallback_ttl
+        self.check_interval = check_interval
+        self.acquire_timeout = acquire_timeout
+        self.slots = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.pending_creates = 0
+        self.refresh_count = 0
+        self.refresher = None
+
+    def start(self):
+        """Create the first session synchronously and warm the rest in the background"""
+        first = PooledSession(self.session_factory(), self.fallback_ttl)
+        with self.condition:
+            self.slots.append(first)
+            self.condition.notify_all()
+        self.refresher = threading.Thread(target=self._refresh_loop, name="nse-session-refresher", daemon=True)
+        self.refresher.start()
+        return first.session
+
+    def _refresh_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                self._refresh_once()
+            except Exception as e:
+                print(f"Error refreshing NSE sessions: {e}")
+            self.wake_event.wait(self.check_interval)
+            self.wake_event.clear()
+
+    def _refresh_once(self):
+        with self.condition:
+            stale = [slot for slot in self.slots if not slot.refreshing and slot.needs_refresh(self.refresh_margin)]
+            for slot in stale:
+                slot.refreshing = True
+            missing = max(0, self.size - len(self.slots) - self.pending_creates)
+            self.pending_creates += missing
+        for slot in stale + [None] * missing:
+            try:
+                if self.stop_event.is_set():
+                    raise RuntimeError("Session pool closed")
+                replacement = PooledSession(self.session_factory(), self.fallback_ttl)
+            except Exception:
+                with self.condition:
+                    if slot is None:
+                        self.pending_creates -= 1
+                    else:
+                        slot.refreshing = False
+                raise
+            with self.condition:
+                if slot is None:
+                    self.pending_creates -= 1
+                    self.slots.append(replacement)
+                else:
+                    self.slots[self.slots.index(slot)] = replacement
+                self.refresh_count += 1
+                self.condition.notify_all()
+
+    def acquire(self):
+        """Return a healthy session without waiting on a cookie handshake when one is warm"""
+        deadline = time.time() + self.acquire_timeout
+        with self.condition:
+            while True:
+                healthy = [slot for slot in self.slots if slot.usable()]
+                if healthy:
+                    return healthy[next(self.counter) % len(healthy)].session
+                # Every session is rejected or expired: make sure the refresher is on it
+                self.wake_event.set()
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if self.slots:
+                print("Warning: no healthy NSE session available, reusing a failed or expired one.")
+                return self.slots[next(self.counter) % len(self.slots)].session
+        raise RuntimeError("No NSE session could be created")
+
+    def report_failure(self, session):
+        """Take a session out of rotation after a 401/403 or an HTML response"""
+        with self.condition:
+            for slot in self.slots:
+                if slot.session is session and not slot.failed:
+                    slot.failed = True
+                    print("Session rejected by NSE, scheduling replacement.")
+        # Wake the refresher so the replacement doesn't wait for the next check
+        self.wake_event.set()
+
+    def close(self):
+        """Stop the refresher and close every pooled session"""
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.refresher is not None and self.refresher is not threading.current_thread():
+            self.refresher.join(timeout=self.check_interval + 1)
+        with self.condition:
+            slots, self.slots = self.slots, []
+        for slot in slots:
+            slot.session.close()
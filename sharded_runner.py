@@ -0,0 +1,344 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import telemetry
+from nse_data_fetcher import NSEDataFetcher
+
+DATE_FORMAT = "%d-%m-%Y"
+
+# Set in each worker process by _init_worker
+_worker_fetcher = None
+
+def _init_worker(fetcher_class, config_path, fetcher_kwargs, worker_slots):
+    """Give the worker process its own fetcher, and so its own sessions and DB connection.
+
+    Each slot holds the process's egress proxy (or None) and its share of
+    that egress IP's request rate.
+    """
+    global _worker_fetcher
+    kwargs = dict(fetcher_kwargs)
+    try:
+        proxy, requests_per_second = worker_slots.get_nowait()
+    except queue.Empty:
+        proxy, requests_per_second = None, None
+    if proxy is not None:
+        kwargs["proxy"] = proxy
+    if requests_per_second is not None:
+        kwargs["requests_per_second"] = requests_per_second
+    _worker_fetcher = fetcher_class(config_path, **kwargs)
+
+def _run_shard(shard):
+    """Fetch a shard; returns its rows, the requests that failed and the worker's metrics since the last shard"""
+    start = time.monotonic()
+    endpoint_name = shard["endpoint_name"]
+    rows = _worker_fetcher.fetch_data(endpoint_name, shard["config"], compact_state=False)
+    # fetch_data logs and swallows errors, so failures come back as data
+    return {"rows": rows, "elapsed": time.monotonic() - start, "pid": os.getpid(),
+            "failed": _worker_fetcher.pop_failed_requests(endpoint_name),
+            "metrics": _worker_fetcher.metrics.drain()}
+
+def _compact_endpoint(endpoint_name):
+    if _worker_fetcher.ingest_state is not None:
+        _worker_fetcher.ingest_state.compact(endpoint_name)
+
+def _chunks(values, size):
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+class ShardedRunner:
+    """Split a full refresh across worker processes.
+
+    A shard is one endpoint with its largest list param (usually the symbols)
+    narrowed to a chunk and its date range narrowed to a slice; each worker
+    process expands its shard with the normal request plan. The coordinator
+    hands out shards one at a time, so fast workers take more of them, and
+    when an endpoint's shards run longer than `target_shard_seconds` its
+    queued shards are split in half so no single shard holds up the run.
+
+    `requests_per_second` in `fetcher_kwargs` is the budget of one egress IP:
+    it is divided between the processes sharing a proxy, or between all of
+    them when no proxies are given.
+    """
+
+    def __init__(self, config_path, processes=None, fetcher_kwargs=None, symbols_per_shard=50, shard_days=365,
+                 target_shard_seconds=300, min_shard_days=7, max_attempts=2, proxies=None, fetcher_class=NSEDataFetcher):
+        self.config_path = config_path
+        self.processes = processes or os.cpu_count() or 1
+        self.fetcher_kwargs = dict(fetcher_kwargs or {})
+        self.symbols_per_shard = symbols_per_shard
+        self.shard_days = shard_days
+        self.target_shard_seconds = target_shard_seconds
+        self.min_shard_days = min_shard_days
+        self.max_attempts = max_attempts
+        self.proxies = list(proxies or [])
+        self.fetcher_class = fetcher_class
+        self.start_date = self.fetcher_kwargs.get("start_date", "01-01-2000")
+        self.end_date = self.fetcher_kwargs.get("end_date", "01-03-2025")
+
+        with open(os.path.join(config_path, "api.json"), "r") as f:
+            self.config_dict = json.load(f)
+        with open(os.path.join(config_path, "schema.json"), "r") as f:
+            self.schema = json.load(f)
+
+        self.rows_by_endpoint = {}
+        self.durations = {}
+        self.failures = []
+        self.splits = 0
+
+    def _log_error(self, error_message):
+        """Log errors to errors.txt file"""
+        try:
+            with open("errors.txt", "a") as f:
+                timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                f.write(f"[{timestamp}] {error_message}\n")
+        except Exception as e:
+            print(f"Error writing to error log: {e}")
+
+    def _date_slices(self, from_date, to_date):
+        start = datetime.datetime.strptime(from_date, DATE_FORMAT)
+        end = datetime.datetime.strptime(to_date, DATE_FORMAT)
+        slices = []
+        while start <= end:
+            slice_end = min(start + datetime.timedelta(days=self.shard_days - 1), end)
+            slices.append((start.strftime(DATE_FORMAT), slice_end.strftime(DATE_FORMAT)))
+            start = slice_end + datetime.timedelta(days=1)
+        return slices
+
+    @staticmethod
+    def _shard_key(params):
+        """The list param sharded on: the longest one, if any has more than one value"""
+        list_keys = [key for key, value in params.items() if isinstance(value, list) and len(value) > 1]
+        return max(list_keys, key=lambda key: len(params[key]), default=None)
+
+    def build_shards(self, endpoint_names=None):
+        """Split each endpoint's config into shards, interleaved across endpoints"""
+        per_endpoint = []
+        for endpoint_name, endpoint_config in self.config_dict.items():
+            if endpoint_names and endpoint_name not in endpoint_names:
+                continue
+            if endpoint_name not in self.schema:
+                self._log_error(f"Schema not found for {endpoint_name}, skipping...")
+                continue
+            params = dict(endpoint_config.get("params", {}))
+            shard_key = self._shard_key(params)
+            value_chunks = _chunks(params[shard_key], self.symbols_per_shard) if shard_key else [None]
+            if "from_date" in params and "to_date" in params:
+                date_slices = self._date_slices(params["from_date"] or self.start_date, params["to_date"] or self.end_date)
+            else:
+                date_slices = [None]
+
+            shards = []
+            for values in value_chunks:
+                for date_slice in date_slices:
+                    shard_params = dict(params)
+                    if values is not None:
+                        shard_params[shard_key] = values
+                    if date_slice is not None:
+                        shard_params["from_date"], shard_params["to_date"] = date_slice
+                    shards.append({"endpoint_name": endpoint_name,
+                                   "config": {**endpoint_config, "params": shard_params},
+                                   "attempts": 0})
+            per_endpoint.append(shards)
+
+        # Round-robin across endpoints so concurrent workers spread over NSE's APIs
+        interleaved = []
+        for i in range(max((len(shards) for shards in per_endpoint), default=0)):
+            interleaved.extend(shards[i] for shards in per_endpoint if i < len(shards))
+        return interleaved
+
+    def split_shard(self, shard):
+        """Halve a shard on its list param, or failing that its date range"""
+        params = shard["config"]["params"]
+        halves = []
+        shard_key = self._shard_key(params)
+        if shard_key:
+            values = params[shard_key]
+            middle = len(values) // 2
+            halves = [{shard_key: values[:middle]}, {shard_key: values[middle:]}]
+        elif params.get("from_date") and params.get("to_date"):
+            start = datetime.datetime.strptime(params["from_date"], DATE_FORMAT)
+            end = datetime.datetime.strptime(params["to_date"], DATE_FORMAT)
+            days = (end - start).days + 1
+            if days >= 2 * self.min_shard_days:
+                middle = start + datetime.timedelta(days=days // 2)
+                halves = [{"to_date": (middle - datetime.timedelta(days=1)).strftime(DATE_FORMAT)},
+                          {"from_date": middle.strftime(DATE_FORMAT)}]
+        if not halves:
+            return [shard]
+        return [{**shard, "config": {**shard["config"], "params": {**params, **half}}} for half in halves]
+
+    def _shard_size(self, shard):
+        params = shard["config"]["params"]
+        shard_key = self._shard_key(params)
+        size = len(params[shard_key]) if shard_key else 1
+        if params.get("from_date") and params.get("to_date"):
+            start = datetime.datetime.strptime(params["from_date"], DATE_FORMAT)
+            end = datetime.datetime.strptime(params["to_date"], DATE_FORMAT)
+            size *= (end - start).days + 1
+        return size
+
+    def _rebalance(self, pending, slow_shard):
+        """Split the queued shards of an endpoint that are as large as one that ran too long.
+
+        Shards already split since are smaller, so a burst of slow results halves
+        each queued shard once rather than once per result.
+        """
+        endpoint_name = slow_shard["endpoint_name"]
+        slow_size = self._shard_size(slow_shard)
+        rebalanced = deque()
+        for shard in pending:
+            if shard["endpoint_name"] == endpoint_name and self._shard_size(shard) >= slow_size:
+                halves = self.split_shard(shard)
+                self.splits += len(halves) - 1
+                rebalanced.extend(halves)
+            else:
+                rebalanced.append(shard)
+        return rebalanced
+
+    @staticmethod
+    def _retry_shards(shard, failed):
+        """Shards covering only the failed requests; a None entry means the whole shard failed"""
+        if any(request_params is None for request_params in failed):
+            return [shard]
+        return [{**shard, "config": {**shard["config"], "params": dict(request_params)}} for request_params in failed]
+
+    def _record(self, shard, result):
+        endpoint_name = shard["endpoint_name"]
+        self.rows_by_endpoint[endpoint_name] = self.rows_by_endpoint.get(endpoint_name, 0) + result["rows"]
+        self.durations.setdefault(endpoint_name, []).append(result["elapsed"])
+
+    def _egress_rate(self):
+        return (self.fetcher_kwargs.get("requests_per_second")
+                or getattr(self.fetcher_class, "DEFAULT_REQUESTS_PER_SECOND", None))
+
+    def _worker_slots(self):
+        """Return each process's (proxy, requests_per_second), splitting every egress IP's rate between its processes"""
+        rate = self._egress_rate()
+        proxies = [self.proxies[i % len(self.proxies)] for i in range(self.processes)] if self.proxies else [None] * self.processes
+        return [(proxy, rate / proxies.count(proxy) if rate else None) for proxy in proxies]
+
+    def worker_kwargs(self):
+        """Fetcher kwargs for a process started without a slot, at the smallest per-process rate"""
+        kwargs = dict(self.fetcher_kwargs)
+        rates = [rate for _, rate in self._worker_slots() if rate]
+        if rates:
+            kwargs["requests_per_second"] = min(rates)
+        return kwargs
+
+    def run(self, endpoint_names=None):
+        """Fetch every shard across the worker processes and return the total rows inserted"""
+        pending = deque(self.build_shards(endpoint_names))
+        endpoints = sorted({shard["endpoint_name"] for shard in pending})
+        print(f"Running {len(pending)} shards over {len(endpoints)} endpoints on {self.processes} processes")
+
+        worker_slots = multiprocessing.Queue()
+        for slot in self._worker_slots():
+            worker_slots.put(slot)
+
+        start = time.monotonic()
+        completed = 0
+        running = {}
+        try:
+            with ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker,
+                                     initargs=(self.fetcher_class, self.config_path, self.worker_kwargs(), worker_slots)) as executor:
+                while pending or running:
+                    # Only as many shards as processes are handed out, so queued
+                    # shards stay with the coordinator and can still be split
+                    while pending and len(running) < self.processes:
+                        shard = pending.popleft()
+                        shard["attempts"] += 1
+                        running[executor.submit(_run_shard, shard)] = shard
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        shard = running.pop(future)
+                        try:
+                            result = future.result()
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            self._log_error(f"Shard failed for {shard['endpoint_name']} with params {shard['config']['params']}: {str(e)}")
+                            if shard["attempts"] < self.max_attempts:
+                                pending.append(shard)
+                            else:
+                                self.failures.append((shard, str(e)))
+                            continue
+                        telemetry.metrics.merge(result["metrics"])
+                        self._record(shard, result)
+                        completed += 1
+                        if result["failed"]:
+                            self._log_error(f"{len(result['failed'])} requests failed for {shard['endpoint_name']} "
+                                            f"with params {shard['config']['params']}")
+                            if shard["attempts"] < self.max_attempts:
+                                pending.extend(self._retry_shards(shard, result["failed"]))
+                            else:
+                                self.failures.extend((shard, f"request failed: {request_params}") for request_params in result["failed"])
+                        if result["elapsed"] > self.target_shard_seconds:
+                            pending = self._rebalance(pending, shard)
+
+                # Checkpoints are compacted once per endpoint after all of its shards are in
+                if self.fetcher_kwargs.get("incremental"):
+                    for future in [executor.submit(_compact_endpoint, endpoint_name) for endpoint_name in endpoints]:
+                        future.result()
+        except BrokenProcessPool as e:
+            self._log_error(f"Worker process died, stopping sharded run: {str(e)}")
+            self.failures.extend((shard, "worker process died") for shard in list(running.values()) + list(pending))
+
+        elapsed = time.monotonic() - start
+        total_rows = sum(self.rows_by_endpoint.values())
+        for endpoint_name in endpoints:
+            durations = self.durations.get(endpoint_name, [])
+            slowest = max(durations, default=0)
+            print(f"Completed {endpoint_name}: {self.rows_by_endpoint.get(endpoint_name, 0)} rows inserted "
+                  f"({len(durations)} shards, slowest {slowest:.1f}s)")
+        print(f"Total rows inserted: {total_rows} in {elapsed:.1f}s "
+              f"({completed} shards done, {self.splits} splits, {len(self.failures)} failed)")
+        metrics_path = self.fetcher_kwargs.get("metrics_path")
+        if metrics_path:
+            telemetry.metrics.export(metrics_path)
+            print(f"Metrics written to {metrics_path}")
+        return total_rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Run NSEDataFetcher across worker processes, sharded by endpoint, symbols and date range.")
+    parser.add_argument("--config", type=str, default="config", help="Config directory (default: config)")
+    parser.add_argument("--endpoints", type=str, nargs="+", default=None, help="Only run these endpoints from api.json")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--workers", type=int, default=1, help="Fetch threads per process (default: 1)")
+    parser.add_argument("--requests-per-second", type=float, default=None, help="Request rate limit per egress IP, split between the processes using it")
+    parser.add_argument("--start-date", type=str, default="01-01-2000")
+    parser.add_argument("--end-date", type=str, default="01-03-2025")
+    parser.add_argument("--symbols-per-shard", type=int, default=50)
+    parser.add_argument("--shard-days", type=int, default=365)
+    parser.add_argument("--target-shard-seconds", type=float, default=300, help="Split an endpoint's queued shards once one runs longer than this")
+    parser.add_argument("--session-pool", type=int, default=None, help="Warm session pool size per process")
+    parser.add_argument("--proxy", type=str, nargs="+", default=None, help="Egress proxies, assigned round-robin to worker processes")
+    parser.add_argument("--incremental", action="store_true", help="Skip windows already recorded in nse.ingest_state")
+    parser.add_argument("--metrics", type=str, default=None, help="Write the merged metrics of all workers here (.prom/.txt or JSON)")
+    args = parser.parse_args()
+
+    fetcher_kwargs = {
+        "start_date": args.start_date,
+        "end_date": args.end_date,
+        "max_workers": args.workers,
+        "requests_per_second": args.requests_per_second,
+        "session_pool_size": args.session_pool,
+        "incremental": args.incremental,
+        "metrics_path": args.metrics
+    }
+    runner = ShardedRunner(args.config, processes=args.processes, fetcher_kwargs=fetcher_kwargs,
+                           symbols_per_shard=args.symbols_per_shard, shard_days=args.shard_days,
+                           target_shard_seconds=args.target_shard_seconds, proxies=args.proxy)
+    runner.run(args.endpoints)
+    if runner.failures:
+        print(f"{len(runner.failures)} shards or requests still failing after {runner.max_attempts} attempts, see errors.txt")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import datetime
+import os
+import threading
+import uuid
+from row_mapper import normalize_timestamp
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+class PostgresSink:
+    """Writes batches into nse.<endpoint> with COPY, merging on the natural key if one is declared"""
+
+    buffers_rows = False
+
+    def __init__(self, psql_conn, natural_key_writer, schema_options):
+        self.psql_conn = psql_conn
+        self.natural_key_writer = natural_key_writer
+        self.schema_options = schema_options
+
+    def write(self, endpoint_name, columns, rows):
+        table_name = f"nse.{endpoint_name.lower()}"
+        options = self.schema_options.get(endpoint_name, {})
+        natural_key = options.get("_natural_key")
+        if not natural_key:
+            return self.psql_conn.copy_rows(table_name, columns, rows)
+        return self.natural_key_writer.write(table_name, columns, rows, natural_key,
+                                             on_conflict=options.get("_on_conflict", "nothing"))
+
+    def flush(self, endpoint_name=None):
+        pass
+
+    def close(self):
+        pass
+
+def _partition_of(value):
+    """(year, month) of an ISO or NSE ("01-Jan-2024") date string, or None"""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return f"{value.year:04d}", f"{value.month:02d}"
+    if not isinstance(value, str) or len(value) < 7:
+        return None
+    if value[4] == "-" and value[:4].isdigit() and value[5:7].isdigit():
+        return value[:4], value[5:7]
+    normalized = normalize_timestamp(value)
+    if normalized is not value and normalized:
+        return normalized[:4], normalized[5:7]
+    return None
+
+def _parse_int(value):
+    return int(float(str(value).replace(",", "")))
+
+def _parse_float(value):
+    return float(str(value).replace(",", ""))
+
+def _parse_timestamp(value):
+    return datetime.datetime.fromisoformat(normalize_timestamp(str(value)))
+
+def _parse_date(value):
+    return _parse_timestamp(value).date()
+
+class ParquetSink:
+    """Writes batches as Parquet files partitioned by endpoint, year and month.
+
+    Files land in `<base_dir>/endpoint=<name>/year=YYYY/month=MM/`, so readers
+    can prune partitions. The partition comes from the endpoint's
+    "_partition_date" column in schema.json, else its first date or
+    timestamp column ("_types", or a column named "date"); endpoints with
+    no date column at all use the write date. Column types follow "_types"
+    (int, numeric, timestamp, date; text otherwise). Rows are buffered per
+    partition and written `rows_per_file` at a time, and on flush().
+    """
+
+    # Rows are only durable after flush(), so NSEDataFetcher defers checkpoints until then
+    buffers_rows = True
+
+    _ARROW_TYPES = {"int": "int64", "numeric": "float64", "timestamp": "timestamp", "date": "date32"}
+    _PARSERS = {"int": _parse_int, "numeric": _parse_float, "timestamp": _parse_timestamp, "date": _parse_date}
+
+    def __init__(self, base_dir, schema_options, compression="zstd", rows_per_file=250000):
+        if pa is None:
+            raise ImportError("ParquetSink requires pyarrow")
+        self.base_dir = base_dir
+        self.schema_options = schema_options
+        self.compression = compression
+        self.rows_per_file = rows_per_file
+        self.buffers = {}
+        self.files_written = 0
+        self.lock = threading.Lock()
+
+    def _arrow_type(self, column_type):
+        if column_type == "timestamp":
+            return pa.timestamp("s")
+        return getattr(pa, self._ARROW_TYPES.get(column_type, "string"))()
+
+    def _column(self, values, column_type):
+        arrow_type = self._arrow_type(column_type)
+        if column_type in (None, "text"):
+            return pa.array([None if value is None else str(value) for value in values], pa.string())
+        try:
+            return pa.array(values, pa.string()).cast(arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+            # Mixed or unusual formats: parse value by value, nulling what doesn't parse
+            parser = self._PARSERS[column_type]
+            parsed = []
+            for value in values:
+                try:
+                    parsed.append(None if value in (None, "") else parser(value))
+                except (ValueError, TypeError):
+                    parsed.append(None)
+            return pa.array(parsed, arrow_type)
+
+    @staticmethod
+    def _partition_column(options, columns):
+        """The column rows are partitioned on: "_partition_date", else the first dated column"""
+        if options.get("_partition_date") in columns:
+            return options["_partition_date"]
+        column_types = options.get("_types", {})
+        for column in columns:
+            if column_types.get(column) in ("date", "timestamp") or column == "date":
+                return column
+        return None
+
+    def write(self, endpoint_name, columns, rows):
+        options = self.schema_options.get(endpoint_name, {})
+        date_column = self._partition_column(options, columns)
+        date_index = columns.index(date_column) if date_column is not None else None
+        today = datetime.date.today()
+        default_partition = (f"{today.year:04d}", f"{today.month:02d}")
+
+        row_count = 0
+        full = []
+        with self.lock:
+            for row in rows:
+                partition = None
+                if date_index is not None:
+                    partition = _partition_of(row[date_index])
+                key = (endpoint_name, tuple(columns), partition or default_partition)
+                buffer = self.buffers.setdefault(key, [])
+                buffer.append(row)
+                row_count += 1
+                if len(buffer) >= self.rows_per_file:
+                    full.append((key, self.buffers.pop(key)))
+        for key, buffer in full:
+            self._write_file(key, buffer)
+        return row_count
+
+    def _write_file(self, key, rows):
+        endpoint_name, columns, (year, month) = key
+        column_types = self.schema_options.get(endpoint_name, {}).get("_types", {})
+        column_values = list(zip(*rows))
+        table = pa.table({column: self._column(list(values), column_types.get(column))
+                          for column, values in zip(columns, column_values)})
+        directory = os.path.join(self.base_dir, f"endpoint={endpoint_name}", f"year={year}", f"month={month}")
+        os.makedirs(directory, exist_ok=True)
+        file_name = f"part-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        tmp_path = os.path.join(directory, f".{file_name}.tmp")
+        pq.write_table(table, tmp_path, compression=self.compression)
+        os.replace(tmp_path, os.path.join(directory, file_name))
+        with self.lock:
+            self.files_written += 1
+
+    def flush(self, endpoint_name=None):
+        """Write out the buffered rows (of one endpoint, or all of them)"""
+        with self.lock:
+            keys = [key for key in self.buffers if endpoint_name is None or key[0] == endpoint_name]
+            pending = [(key, self.buffers.pop(key)) for key in keys]
+        for key, rows in pending:
+            self._write_file(key, rows)
+
+    def close(self):
+        self.flush()
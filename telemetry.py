@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def merge(self, other):
+        if other.buckets != self.buckets:
+            raise ValueError("Cannot merge histograms with different buckets")
+        self.bucket_counts = [a + b for a, b in zip(self.bucket_counts, other.bucket_counts)]
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+class Metrics:
+    """Thread-safe registry of labelled counters and histograms, with optional timing spans.
+
+    Metrics are keyed by name and a set of labels (usually the endpoint), and
+    exported as Prometheus text or a JSON summary. With `trace=True` every
+    `span()` is also kept (up to `max_spans`) with its start time and thread.
+    """
+
+    def __init__(self, trace=False, max_spans=10000):
+        self.counters = {}
+        self.histograms = {}
+        self.trace = trace
+        self.spans = deque(maxlen=max_spans)
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def drain(self):
+        """Return the counters and histograms and reset them, for shipping to another process"""
+        with self.lock:
+            state = {"counters": self.counters, "histograms": self.histograms}
+            self.counters = {}
+            self.histograms = {}
+        return state
+
+    def merge(self, state):
+        """Add counters and histograms returned by drain() in another process"""
+        with self.lock:
+            for key, value in state["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, other in state["histograms"].items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(other.buckets)
+                histogram.merge(other)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the block into the `<name>_seconds` histogram"""
+        start_wall = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(f"{name}_seconds", elapsed, **labels)
+            if self.trace:
+                with self.lock:
+                    self.spans.append({"name": name, "labels": {k: v for k, v in labels.items() if v is not None},
+                                       "start": start_wall, "seconds": elapsed,
+                                       "thread": threading.current_thread().name})
+
+    @staticmethod
+    def _format_labels(labels, extra=None):
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = ",".join(f'{key}="{_escape_label(value)}"' for key, value in pairs)
+        return "{" + escaped + "}"
+
+    def to_prometheus(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            lines = []
+            typed = set()
+            for (name, labels), value in counters:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{self._format_labels(labels)} {value}")
+            for (name, labels), histogram in histograms:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._format_labels(labels, ('le', bound))} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Counters and histogram stats grouped by metric name"""
+        with self.lock:
+            result = {"started_at": self.started_at, "elapsed_seconds": time.time() - self.started_at,
+                      "counters": {}, "histograms": {}}
+            for (name, labels), value in sorted(self.counters.items()):
+                result["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                result["histograms"].setdefault(name, []).append({
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "avg": histogram.sum / histogram.count if histogram.count else None,
+                    "min": histogram.min,
+                    "max": histogram.max
+                })
+            if self.trace:
+                result["spans"] = list(self.spans)
+        return result
+
+    def export(self, path):
+        """Write the metrics to `path`: Prometheus text for .prom/.txt, otherwise JSON"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            if os.path.splitext(path)[1] in (".prom", ".txt"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), f, indent=4, default=str)
+        os.replace(tmp_path, path)
+
+# Process-wide registry used when a component isn't given its own
+metrics = Metrics()
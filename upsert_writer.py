@@ -0,0 +1,99 @@
+import threading
+
+class NaturalKeyWriter:
+    """Idempotent writer for endpoints that declare a natural key in schema.json.
+
+    Rows are first deduplicated against the keys already written in this
+    process, then COPYed into a temp staging table and merged into the target
+    with INSERT ... ON CONFLICT. The unique index backing ON CONFLICT is
+    created by the migration in metadata_setup/create_db.sql; when it is
+    missing (e.g. the table still holds duplicates), the merge falls back to an
+    INSERT ... WHERE NOT EXISTS.
+
+    Rows with a NULL in a key column are skipped: a unique index never treats
+    NULLs as equal, so they would be inserted again on every run.
+    """
+
+    def __init__(self, psql_conn):
+        self.psql_conn = psql_conn
+        self.lock = threading.Lock()
+        # Per-table set of the key tuples written in this run
+        self.seen_keys = {}
+        self.strategies = {}
+
+    def _strategy(self, table_name, key_columns):
+        """"on_conflict" if the natural-key unique index exists, else "not_exists". Never runs DDL."""
+        with self.lock:
+            if table_name in self.strategies:
+                return self.strategies[table_name]
+        schema, table = table_name.split(".")
+        index_name = f"{table}_natural_key_idx"
+        result = self.psql_conn.execute(f"""
+            select 1 from pg_indexes where schemaname = '{schema}' and indexname = '{index_name}';
+            """)
+        strategy = "on_conflict" if result else "not_exists"
+        if strategy == "not_exists":
+            print(f"No unique index {index_name} on {table_name} ({', '.join(key_columns)}), merging with NOT EXISTS")
+        with self.lock:
+            self.strategies[table_name] = strategy
+        return strategy
+
+    def _merge_sql(self, table_name, staging_name, columns, key_columns, strategy, on_conflict):
+        column_list = ", ".join(columns)
+        if strategy == "on_conflict":
+            conflict = "do nothing"
+            update_columns = [col for col in columns if col not in key_columns]
+            if on_conflict == "update" and update_columns:
+                conflict = "do update set " + ", ".join(f"{col} = excluded.{col}" for col in update_columns)
+            insert = f"""
+                insert into {table_name} ({column_list})
+                select {column_list} from {staging_name}
+                on conflict ({', '.join(key_columns)}) {conflict}
+                returning 1"""
+        else:
+            # Rows with NULL keys never reach the merge, so plain equality matches
+            # them like the unique index would and keeps the key columns indexable
+            match = " and ".join(f"t.{col} = s.{col}" for col in key_columns)
+            insert = f"""
+                insert into {table_name} ({column_list})
+                select {', '.join(f's.{col}' for col in columns)} from {staging_name} s
+                where not exists (select 1 from {table_name} t where {match})
+                returning 1"""
+        return f"with inserted as ({insert}) select count(*) from inserted;"
+
+    def write(self, table_name, columns, rows, key_columns, on_conflict="nothing"):
+        """Write column-ordered rows, skipping duplicates. Returns the rows actually inserted."""
+        key_indexes = [columns.index(col) for col in key_columns]
+        fresh_rows = []
+        batch_keys = set()
+        null_keys = 0
+        with self.lock:
+            seen = self.seen_keys.setdefault(table_name, set())
+            for row in rows:
+                key = tuple(row[i] for i in key_indexes)
+                if None in key:
+                    null_keys += 1
+                    continue
+                if key in seen or key in batch_keys:
+                    continue
+                batch_keys.add(key)
+                fresh_rows.append(row)
+        if null_keys:
+            print(f"Skipped {null_keys} rows for {table_name} with a NULL in its natural key ({', '.join(key_columns)})")
+        if not fresh_rows:
+            return 0
+        
+        strategy = self._strategy(table_name, key_columns)
+        staging_name = f"stage_{table_name.split('.')[-1]}"
+        # The staging table is a temp table, so every step must use the same connection
+        with self.psql_conn.lease():
+            self.psql_conn.execute(f"create temp table if not exists {staging_name} (like {table_name} including defaults);")
+            self.psql_conn.execute(f"truncate {staging_name};")
+            self.psql_conn.copy_rows(staging_name, columns, fresh_rows)
+            result = self.psql_conn.execute(self._merge_sql(table_name, staging_name, columns, key_columns, strategy, on_conflict))
+        if not result:
+            raise RuntimeError(f"Merge from {staging_name} into {table_name} failed")
+        
+        with self.lock:
+            seen.update(batch_keys)
+        return result[0][0]
@@ -0,0 +1,96 @@
+import datetime
+import json
+import os
+import threading
+
+DATE_FORMAT = "%d-%m-%Y"
+
+class AdaptiveWindowPlanner:
+    """Date-window planner that resizes windows from observed response volume.
+
+    Windows are generated lazily from the end of the period backwards, so
+    each new window uses the size learned from the responses seen so far.
+    Small responses double the window, responses over the row/byte/latency
+    thresholds halve it, and a window that times out is split in two and
+    fetched again.
+    """
+
+    def __init__(self, initial_days=7, min_days=1, max_days=365, widen_below_rows=100,
+                 split_above_rows=2000, split_above_bytes=5_000_000, slow_seconds=30):
+        self.min_days = min_days
+        self.max_days = max_days
+        self.window_days = min(max(int(initial_days), min_days), max_days)
+        self.widen_below_rows = widen_below_rows
+        self.split_above_rows = split_above_rows
+        self.split_above_bytes = split_above_bytes
+        self.slow_seconds = slow_seconds
+        self.lock = threading.Lock()
+
+    def window_ranges(self, from_date, to_date):
+        """Yield {"from_date", "to_date"} windows covering the period, newest first"""
+        start = datetime.datetime.strptime(from_date, DATE_FORMAT)
+        current_end = datetime.datetime.strptime(to_date, DATE_FORMAT)
+        while current_end >= start:
+            current_start = max(start, current_end - datetime.timedelta(days=self.window_days))
+            yield {
+                "from_date": current_start.strftime(DATE_FORMAT),
+                "to_date": current_end.strftime(DATE_FORMAT)
+            }
+            current_end = current_start - datetime.timedelta(days=1)
+
+    def observe(self, rows, response_bytes, elapsed):
+        """Resize the window from one successful response"""
+        with self.lock:
+            if rows >= self.split_above_rows or response_bytes >= self.split_above_bytes or elapsed >= self.slow_seconds:
+                self.window_days = max(self.min_days, self.window_days // 2)
+            elif (rows < self.widen_below_rows and response_bytes < self.split_above_bytes // 4
+                  and elapsed < self.slow_seconds / 4):
+                self.window_days = min(self.max_days, self.window_days * 2)
+
+    def observe_timeout(self):
+        with self.lock:
+            self.window_days = max(self.min_days, self.window_days // 2)
+
+    @staticmethod
+    def split(date_range):
+        """Split a window into two halves, or return None for a single day"""
+        start = datetime.datetime.strptime(date_range["from_date"], DATE_FORMAT)
+        end = datetime.datetime.strptime(date_range["to_date"], DATE_FORMAT)
+        if end <= start:
+            return None
+        middle = start + (end - start) // 2
+        return [
+            {"from_date": (middle + datetime.timedelta(days=1)).strftime(DATE_FORMAT), "to_date": end.strftime(DATE_FORMAT)},
+            {"from_date": start.strftime(DATE_FORMAT), "to_date": middle.strftime(DATE_FORMAT)}
+        ]
+
+class WindowSizeStore:
+    """JSON file holding the learned window size of each endpoint between runs"""
+
+    def __init__(self, path):
+        self.path = path
+        self.sizes = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.sizes = json.load(f)
+
+    def get(self, endpoint_name, default):
+        return self.sizes.get(endpoint_name, default)
+
+    def save(self, endpoint_name, window_days):
+        # Several processes may share the file, so merge with what is on disk
+        # and replace it atomically instead of overwriting other endpoints
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.sizes = {**self.sizes, **json.load(f)}
+            except ValueError:
+                pass
+        self.sizes[endpoint_name] = window_days
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.sizes, f, indent=4)
+        os.replace(tmp_path, self.path)
@@ -3,14 +3,16 @@ import googleapiclient.errors
 from youtube_transcript_api import YouTubeTranscriptApi
 import requests
 from bs4 import BeautifulSoup
+import telemetry
 
 class YoutubeTool:
     """A tool to interact with YouTube data."""
     
-    def __init__(self, serp_api_key=None, youtube_api_key = None):
+    def __init__(self, serp_api_key=None, youtube_api_key = None, metrics=None):
         """Initialize with YouTube API key."""
         self.serp_api_key = serp_api_key
         self.youtube_api_key = youtube_api_key
+        self.metrics = metrics or telemetry.metrics
         self._init_youtube_client()
         self.transcriptor = YouTubeTranscriptApi()
         
@@ -23,12 +25,23 @@ class YoutubeTool:
         else:
             self.youtube = None
             
+    def _execute(self, method, request):
+        """Execute a YouTube API request, recording its latency and errors."""
+        try:
+            with self.metrics.span("youtube_api", method=method):
+                return request.execute()
+        except Exception:
+            self.metrics.inc("youtube_errors_total", method=method)
+            raise
+
     def get_transcript(self, video_id):
         """Get the transcript text for a YouTube video."""
         try:
-            transcript = self.transcriptor.fetch(video_id)
+            with self.metrics.span("youtube_transcript"):
+                transcript = self.transcriptor.fetch(video_id)
             return " ".join(snippet.text for snippet in transcript)
         except Exception as e:
+            self.metrics.inc("youtube_errors_total", method="transcript")
             print(f"Error fetching transcript: {e}")
             return None
     
@@ -48,7 +61,7 @@ class YoutubeTool:
                     maxResults=min(50, max_results),
                     pageToken=next_page_token
                 )
-                response = request.execute()
+                response = self._execute("playlists", request)
                 
                 for item in response["items"]:
                     playlist_data = {
@@ -83,7 +96,7 @@ class YoutubeTool:
                 type="channel",
                 maxResults=1
             )
-            response = request.execute()
+            response = self._execute("channels", request)
             
             if response["items"]:
                 return response["items"][0]["id"]["channelId"]
@@ -108,7 +121,7 @@ class YoutubeTool:
                     maxResults=min(50, max_results - len(videos)),
                     pageToken=next_page_token
                 )
-                response = request.execute()
+                response = self._execute("playlist_items", request)
                 
                 for item in response["items"]:
                     video_data = {
@@ -141,7 +154,7 @@ class YoutubeTool:
                 part="snippet,contentDetails,statistics",
                 id=video_id
             )
-            response = request.execute()
+            response = self._execute("videos", request)
             
             if response["items"]:
                 video = response["items"][0]
@@ -180,7 +193,7 @@ class YoutubeTool:
                     maxResults=min(50, max_results - len(videos)),
                     pageToken=next_page_token
                 )
-                response = request.execute()
+                response = self._execute("search", request)
                 
                 for item in response["items"]:
                     video_data = {